@@ -1,50 +1,160 @@
 import logging
+from collections import deque
 
-from lxml import etree
+from metrics import metrics
+from structure import ignored_parents
+from utility import get_pom_vars, map_dependency_version
 
-from utility import get_pom_vars
 
+def __assign_children(records, struct):
+    """
+    Assigns every child pom to its parent in the dictionary in a single pass.
+
+    The parent -> child edges are found once from the coordinates in the records, and the poms are visited breadth-first starting
+    from the parent poms, so a pom is always visited after its own parent has been assigned. Poms that could not be reached this
+    way are tried once more afterwards, since their parent may still be found using an alternative name. The poms that are left
+    are reported as either orphans or part of a cycle.
+    :param records: The PomRecords of all the poms, the parent poms must already have been assigned.
+    :param struct: The structure object.
+    :return: Returns the number of poms that were assigned as children.
+    """
+    roots, parents, children = __find_edges(records, ignored_parents)
+    assigned = [False] * len(records)
+    for root in roots:
+        assigned[root] = True
+
+    queue = deque(child for root in roots for child in children[root])
+    nr_of_assigned = __assign_in_order(queue, records, children, assigned, struct)
+    # Retry the poms not reachable through the edges, once each, together with anything that can be reached from them.
+    for i in range(len(records)):
+        if not assigned[i]:
+            nr_of_assigned += __assign_in_order(deque([i]), records, children, assigned, struct)
 
-def __find_children(path, struct, last_round=False):
+    __report_unassigned(records, parents, assigned)
+    return nr_of_assigned
+
+
+def __find_edges(records, ignored_parents):
+    """
+    Finds the parent of every pom, by matching the <parent> coordinates to the groupId and artifactId of the other poms.
+    If no pom has the exact coordinates, the parent is found using the artifactId alone, if it is unique.
+    :param records: The PomRecords of all the poms.
+    :param ignored_parents: The parent artifactIds that makes a pom a parent pom.
+    :return: The indexes of the parent poms, the index of the parent for each pom (None if not found) and the indexes of the
+    children for each pom.
     """
-    Runs through the poms and assigns children to their respective parents in the dictionary.
+    roots, parents, children = [], [None] * len(records), [[] for _ in records]
+    by_coordinates, by_artifact = {}, {}
+    for i, record in enumerate(records):
+        # A pom without its own groupId inherits it from its parent.
+        group_id = record.parent_group_id if record.group_id is None else record.group_id
+        by_coordinates.setdefault((group_id, record.artifact_id), i)
+        by_artifact.setdefault(record.artifact_id, []).append(i)
+
+    for i, record in enumerate(records):
+        if record.parent_artifact_id is None or record.parent_artifact_id in ignored_parents:
+            roots.append(i)
+            continue
+        parent = by_coordinates.get((record.parent_group_id, record.parent_artifact_id))
+        if parent is None and len(by_artifact.get(record.parent_artifact_id, [])) == 1:
+            parent = by_artifact[record.parent_artifact_id][0]
+        if parent is not None:
+            parents[i] = parent
+            children[parent].append(i)
+    return roots, parents, children
+
+
+def __assign_in_order(queue, records, children, assigned, struct):
+    """
+    Assigns the poms in the queue, and breadth-first the children of every pom that is assigned.
+    :return: Returns the number of poms that were assigned.
+    """
+    nr_of_assigned, steps = 0, 0
+    while queue:
+        i = queue.popleft()
+        steps += 1
+        if assigned[i]:
+            continue
+        if __find_children(records[i], struct):
+            assigned[i] = True
+            nr_of_assigned += 1
+            queue.extend(children[i])
+    metrics.count('child_pass_steps', steps)
+    return nr_of_assigned
+
+
+def __report_unassigned(records, parents, assigned):
+    """
+    Logs the poms that could not be assigned, either as part of a cycle of <parent> tags or as orphans. An orphan either has a
+    <parent> that is not among the poms, or is below such a pom, and the orphans are summed up by the missing <parent>.
+    """
+    on_path, in_cycle = {}, set()
+    for i in range(len(records)):
+        path, j = [], i
+        while j is not None and not assigned[j] and j not in on_path:
+            on_path[j] = i
+            path.append(j)
+            j = parents[j]
+        if j is not None and on_path.get(j) == i:
+            cycle = path[path.index(j):] + [j]
+            in_cycle.update(cycle)
+            logging.warning(f'Cycle in <parent> tags: {" -> ".join(records[k].artifact_id for k in cycle)}')
+
+    # Missing <parent> coordinates -> the orphans missing it, directly or through their own parents.
+    missing_parents, not_attached = {}, 0
+    for i in range(len(records)):
+        if assigned[i] or i in in_cycle:
+            continue
+        j = i
+        while parents[j] is not None and not assigned[parents[j]] and parents[j] not in in_cycle:
+            j = parents[j]
+        if parents[j] is None:
+            missing_parents.setdefault(f'{records[j].parent_group_id}:{records[j].parent_artifact_id}', []).append(i)
+        else:
+            not_attached += 1
+    for coordinates, orphans in missing_parents.items():
+        logging.warning(f'Missing <parent> {coordinates}: {len(orphans)} orphan poms could not be assigned: '
+                        f'{", ".join(records[k].artifact_id for k in orphans[:5])}{", ..." if len(orphans) > 5 else ""}')
+    if not_attached:
+        logging.warning(f'{not_attached} poms could not be assigned below their <parent>, or below a cycle of <parent> tags.')
+
+    for i, record in enumerate(records):
+        if not assigned[i]:
+            logging.debug(f'Could not assign: {record.path}')
+            logging.debug(f'         -| {record.parent_group_id} ({str(record.group_id)})  :  {str(record.parent_artifact_id)}  :  '
+                          f'{str(record.artifact_id)}')
+
+
+def __find_children(record, struct):
+    """
+    Assigns the child pom to its parent in the dictionary.
 
     Also assigns alternative names, by looking at poms that have double group IDs.
-    Ensures to map dependencies if new <properties> definitions are found.
-    :param path: The relative path of the pom.xml file.
-    :param last_round: Used to indicate that it is the last run through of assigning poms.
+    Ensures to map dependencies if new <properties> definitions are found in an assigned pom.
+    :param record: The PomRecord of the pom.
     :return: Returns 1 of the pom was assigned in the dictionary, 0 otherwise.
     """
     obj = struct.obj
     created = False
-    tree = etree.parse(path)
-    alt_package_id, child_id, dependencies, package_id, parent_id, version = get_pom_vars(tree, struct)
+    alt_package_id, child_id, dependencies, package_id, parent_id, version = get_pom_vars(record)
 
     # Skip pom if it has no <parent> or the <parent> tag contains specific strings.
-    if parent_id is None or (parent_id in struct.ignored_parents):
+    if parent_id is None or (parent_id in ignored_parents):
         return 0
     if package_id in obj:
         # Handle alternative names using extra groupIds defined in poms.
-        alt_list = obj[package_id]['alt-name']
-        if alt_package_id is not None and alt_package_id not in alt_list:
-            alt_list.append(alt_package_id)
+        if alt_package_id is not None:
+            struct.add_alt_name(package_id, alt_package_id)
 
-        # If parent exists in this layer, then insert child in modules list
-        created = __recursive_add_children(parent_id, obj[package_id]['modules'], child_id, version, dependencies)
+        # If parent exists in this package, then insert child in its modules list
+        created = __add_to_parent(struct, package_id, parent_id, child_id, version, dependencies)
 
-    # Created is None if pom was skipped due to already having being created.
-    if created:
-        return 1
     # If child was not created due to parent not being found, try using alternative parent name
-    elif not created:
-        created_using_alt_name = __find_children_alt_name(struct, parent_id, package_id, child_id, alt_package_id, version, dependencies)
-        # If created successfully return 1
-        if created_using_alt_name:
-            return 1
-        # If it was not created, and not skipped due to being a duplicate print the path that was skipped.
-        elif not created_using_alt_name and last_round:
-            logging.debug(f'Could not assign: {path}')
-            logging.debug(f'         -| {package_id} ({str(alt_package_id)})  :  {str(parent_id)}  :  {str(child_id)}')
+    if created or __find_children_alt_name(struct, parent_id, package_id, child_id, alt_package_id, version, dependencies):
+        # Maps the versions that are declared through properties in the pom to their actual values. This is only done once the
+        # pom is assigned, so the poms that are tried again, and the orphans, add nothing to the dependency map.
+        map_dependency_version(package_id, child_id, version, record.properties, struct)
+        return 1
     return 0
 
 
@@ -59,48 +169,43 @@ def __find_children_alt_name(util, parent_id, package_id, child_id, alt_package_
     :param dependencies: The dependencies of the pom.
     :return: True of the child was assigned in the dictionary, False otherwise.
     """
-    for key, val in util.obj.items():
-        alt_names = val['alt-name']
-        if alt_names is not None and package_id in alt_names:
-            if alt_package_id is not None and alt_package_id not in alt_names:
-                logging.debug(f'Alt-name \'{alt_package_id}\' added to \'{key}\'.')
-                alt_names.append(alt_package_id)
-            return __recursive_add_children(parent_id, util.obj[key]['modules'], child_id, version, dependencies)
-    return False
+    key = util.find_package_by_alt_name(package_id)
+    if key is None:
+        return False
+    if alt_package_id is not None and util.add_alt_name(key, alt_package_id):
+        logging.debug(f'Alt-name \'{alt_package_id}\' added to \'{key}\'.')
+    return __add_to_parent(util, key, parent_id, child_id, version, dependencies)
 
 
-def __recursive_add_children(parent_id, current_modules, child_id, version, dependencies):
+def __add_to_parent(struct, package_id, parent_id, child_id, version, dependencies):
     """
-    Recursively tries to add the child pom to a level of 'modules' in the dictionary structure.
+    Tries to add the child pom under its parent module in the package, using the module index of the structure.
+    :param package_id: The package the parent module belongs to.
     :param parent_id: The parent ID from the child pom.
-    :param current_modules: The current 'modules' list.
     :param child_id: The child ID from the pom (artifact ID of the pom)
     :param version: The version of the module, as described in the pom.
     :param dependencies: The dependencies found under the <dependencies> tag in the pom.
     :return: Return True if the child pom was created in the dictionary, False otherwise.
     """
-    for inner_mod in current_modules:
-        if parent_id == inner_mod['name']:
-            created = __add_child(child_id, version, dependencies, inner_mod)
-        else:
-            created = __recursive_add_children(parent_id, inner_mod['modules'], child_id, version, dependencies)
-        if created:
-            return True
-    return False
+    parent = struct.find_module(package_id, parent_id)
+    if parent is None:
+        return False
+    return __add_child(struct, package_id, child_id, version, dependencies, parent)
 
 
-def __add_child(child_id, version, dependencies, module):
+def __add_child(struct, package_id, child_id, version, dependencies, module):
     """
     Assigns the given child pom information to the dictionary if it does not already exist.
+    :param package_id: The package of the parent module.
     :param child_id: The child pom artifact ID.
     :param version: The module ID.
     :param dependencies: The dependencies found in the pom.
-    :param module: The index in the dictionary.
+    :param module: The parent module in the dictionary.
     :return: Returns True
     """
-    if child_id not in [x['name'] for x in module['modules']]:
+    if not struct.has_child(module, child_id):
         logging.debug(f'Created: {child_id}.')
-        module['modules'].append({'name': child_id, 'version': version, 'modules': [], 'dependencies': dependencies})
+        struct.add_module(package_id, child_id, version, dependencies, module)
     else:
         logging.debug(f'Skipped: {child_id} - already exists.')
     return True
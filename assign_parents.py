@@ -1,32 +1,29 @@
-from lxml import etree
+import logging
 
+from structure import ignored_parents
 from utility import map_dependency_version, find_dependencies
 
 
-def __find_parents(path, struct):
+def __find_parents(record, struct):
     """
-    Traverses the tree and assign parent poms to the 'structure' dictionary.
-    :param path: The given absolute path to the pom.xml file.
+    Assigns the pom to the 'structure' dictionary if it is a parent pom.
+    :param record: The PomRecord of the pom.
     :return: Returns 1 if a parent is created, 0 otherwise.
     """
-    tree = etree.parse(path)
-    has_parent = False
-    ns = struct.ns
-
-    for node in tree.xpath('//pom:parent/pom:artifactId', namespaces=ns):
-        if node is not None and node.text not in struct.ignored_parents:
-            has_parent = True
-            break
+    has_parent = record.parent_artifact_id is not None and record.parent_artifact_id not in ignored_parents
 
     if not has_parent:
-        package_id = tree.xpath('./pom:groupId', namespaces=ns)[0].text.lower()
+        # A pom with an ignored parent may inherit the groupId from it.
+        package_id = record.parent_group_id if record.group_id is None else record.group_id
+        if package_id is None:
+            logging.debug(f'Skipped parent pom without groupId: {record.path}')
+            return 0
         struct.create_package(package_id)
-        parent_id = tree.xpath('./pom:artifactId', namespaces=ns)[0].text.lower()
-        version = 'n/a' if len(tree.xpath('./pom:version', namespaces=ns)) == 0 else tree.xpath('./pom:version', namespaces=ns)[0].text
+        parent_id = record.artifact_id
+        version = 'n/a' if record.version is None else record.version
         # Maps the versions that are declared through properties in the parent pom to their actual values
-        map_dependency_version(package_id, parent_id, version, tree, struct)
-        struct.obj[package_id]['modules'].append(
-            {'name': parent_id, 'version': version, 'modules': [], 'dependencies': find_dependencies(tree, None, ns)})
+        map_dependency_version(package_id, parent_id, version, record.properties, struct)
+        struct.add_module(package_id, parent_id, version, find_dependencies(record.dependencies, None))
 
         return 1
     return 0
@@ -0,0 +1,195 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from lxml import etree
+
+from assign_children import __assign_children
+from assign_parents import __find_parents
+from generate_corpus import generate_corpus
+from pom_record import PomRecord, read_pom_record
+from run import config, find_poms, ns, parse_poms, setup_logging
+from structure import Structure
+from utility import fix_dependency_versions
+
+PHASES = ['discovery', 'parsing', 'parent_pass', 'child_pass', 'version_fixing', 'output_json', 'output_csv']
+EXTRACTIONS = ['parse', 'xpath', 'walk']
+
+
+def benchmark(path, processes=1):
+    """
+    Runs the phases of run.py once on the poms in the given path, timing each phase separately. The outputs are written to the
+    current working directory.
+    :param path: The path of the poms.
+    :param processes: The number of processes used to parse the poms.
+    :return: A dictionary with the seconds spent in every phase.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    def lap(phase):
+        nonlocal start
+        now = time.perf_counter()
+        timings[phase] = round(now - start, 4)
+        start = now
+
+    pom_paths = list(find_poms(path))
+    lap('discovery')
+    records = parse_poms(pom_paths, processes)
+    lap('parsing')
+    struct = Structure()
+    for record in records:
+        __find_parents(record, struct)
+    lap('parent_pass')
+    __assign_children(records, struct)
+    lap('child_pass')
+    fix_dependency_versions(struct.obj, struct.dependency_map)
+    struct.remove_alt_name()
+    lap('version_fixing')
+    struct.write_dependency_map_json()
+    struct.write_dependency_index_json()
+    struct.write_json()
+    lap('output_json')
+    struct.write_csv()
+    lap('output_csv')
+    return timings
+
+
+def run_benchmarks(sizes, repeat=1, processes=1, depth=4, fan_out=4, results_path='benchmark_results.jsonl'):
+    """
+    Generates a synthetic corpus of every size and benchmarks the phases on it, keeping the fastest time of every phase over the
+    repetitions. One line of JSON per size is appended to the results file, so runs of different versions can be compared.
+    :param sizes: The numbers of poms to benchmark with.
+    :param repeat: The number of times every size is benchmarked.
+    :param processes: The number of processes used to parse the poms.
+    :param depth: The depth of the hierarchy of every package in the corpus.
+    :param fan_out: The number of children of every pom in the corpus.
+    :param results_path: The file the results are appended to.
+    """
+    results_path = os.path.abspath(results_path)
+    commit = __git_commit()
+    cwd = os.getcwd()
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            poms_dir = os.path.join(work_dir, 'releases')
+            generate_corpus(poms_dir, size, depth, fan_out)
+            os.chdir(work_dir)
+            try:
+                runs = [benchmark(poms_dir, processes) for _ in range(repeat)]
+            finally:
+                os.chdir(cwd)
+
+        timings = {phase: min(timing[phase] for timing in runs) for phase in PHASES}
+        timings['total'] = round(sum(timings.values()), 4)
+        result = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': commit,
+                  'python': platform.python_version(), 'poms': size, 'depth': depth, 'fan_out': fan_out,
+                  'processes': processes, 'repeat': repeat, 'seconds': timings}
+        logging.info(f'{size} poms: ' + ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in timings.items()))
+        with open(results_path, 'a') as results:
+            results.write(json.dumps(result) + '\n')
+
+
+def benchmark_extraction(path, repeat=1, results_path='benchmark_results.jsonl'):
+    """
+    Compares the extraction of the pom records by read_pom_record with the earlier extraction using an XPath query per field, on
+    the poms in the given path, e.g. the releases/ downloaded from nexus. Every pom is also only parsed, which is the part of the
+    time spent in lxml that neither extraction can avoid. The records of both extractions must be the same. One line of JSON is
+    appended to the results file.
+    :param path: The path of the poms.
+    :param repeat: The number of times the poms are read, the fastest time being kept.
+    :param results_path: The file the results are appended to.
+    :return: True if both extractions gave the same records.
+    """
+    pom_paths = list(find_poms(path))
+    extractions = {'parse': etree.parse, 'xpath': lambda pom_path: __read_pom_record_xpath(pom_path, ns),
+                   'walk': lambda pom_path: read_pom_record(pom_path, ns)}
+    timings, records = {}, {}
+    for extraction, extract in extractions.items():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            records[extraction] = [extract(pom_path) for pom_path in pom_paths]
+            seconds = round(time.perf_counter() - start, 4)
+            timings[extraction] = min(timings.get(extraction, seconds), seconds)
+    same = records['xpath'] == records['walk']
+    for pom_path, xpath_record, walk_record in zip(pom_paths, records['xpath'], records['walk']):
+        if xpath_record != walk_record:
+            logging.warning(f'The extractions differ for {pom_path}: {xpath_record} != {walk_record}')
+
+    result = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': __git_commit(),
+              'python': platform.python_version(), 'poms': len(pom_paths), 'bytes': sum(map(os.path.getsize, pom_paths)),
+              'repeat': repeat, 'same_records': same, 'extraction_seconds': timings}
+    logging.info(f'{len(pom_paths)} poms: ' + ', '.join(f'{extraction} {seconds:.3f}s' for extraction, seconds in timings.items())
+                 + (', the records are the same.' if same else ', the records DIFFER.'))
+    with open(results_path, 'a') as results:
+        results.write(json.dumps(result) + '\n')
+    return same
+
+
+def __read_pom_record_xpath(path, ns):
+    """ The extraction of read_pom_record before it walked the pom, with an XPath query for every field, kept for comparison. """
+    tree = etree.parse(path)
+    artifact_id = tree.xpath('./pom:artifactId', namespaces=ns)[0].text.lower()
+    group_id = __first_text(tree, './pom:groupId', ns)
+    version = __first_text(tree, './pom:version', ns)
+    parent_group_id = __first_text(tree, '//pom:parent/pom:groupId', ns)
+    parent_artifact_id = __first_text(tree, '//pom:parent/pom:artifactId', ns)
+    parent_version = __first_text(tree, '//pom:parent/pom:version', ns)
+
+    properties = []
+    for p in tree.xpath('./pom:properties', namespaces=ns):
+        for prop in p.iterchildren(tag=etree.Element):
+            properties.append((etree.QName(prop).localname, prop.text))
+
+    dependencies = []
+    for dependency in tree.xpath('//pom:dependencies/pom:dependency', namespaces=ns):
+        dependency_version = dependency.xpath('./pom:version', namespaces=ns)
+        dependencies.append((dependency.xpath('./pom:artifactId', namespaces=ns)[0].text,
+                             dependency_version[0].text if dependency_version else 'inherited'))
+
+    return PomRecord(path, group_id.lower() if group_id is not None else None, artifact_id, version,
+                     parent_group_id.lower() if parent_group_id is not None else None,
+                     parent_artifact_id.lower() if parent_artifact_id is not None else None,
+                     parent_version, tuple(properties), tuple(dependencies))
+
+
+def __first_text(tree, path, ns):
+    """ Returns the text of the first node matching the xpath, or None if there is no such node. """
+    nodes = tree.xpath(path, namespaces=ns)
+    return nodes[0].text if nodes else None
+
+
+def __git_commit():
+    """ Returns the current git commit of the repository, or None if it is not found. """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Benchmarks the phases of run.py on synthetic corpora of different sizes.')
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 5000, 20000],
+                        help='The numbers of poms to benchmark with, by default 1000 5000 20000.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of times every size is benchmarked, by default 3.')
+    parser.add_argument('--processes', type=int, default=config.getint("worker", "parse_processes"),
+                        help='The number of processes used to parse the poms, by default [worker] parse_processes.')
+    parser.add_argument('--depth', type=int, default=4, help='The depth of the hierarchy of every package, by default 4.')
+    parser.add_argument('--fan-out', type=int, default=4, help='The number of children of every pom, by default 4.')
+    parser.add_argument('--results', default='benchmark_results.jsonl',
+                        help='The file the results are appended to, by default \'benchmark_results.jsonl\'.')
+    parser.add_argument('--extraction', metavar='PATH',
+                        help='Instead of the phases, compare the extraction of the pom records with the earlier XPath extraction '
+                             'on the poms in PATH, e.g. releases/.')
+    args = parser.parse_args()
+    if args.extraction:
+        sys.exit(0 if benchmark_extraction(args.extraction, args.repeat, args.results) else 1)
+    run_benchmarks(args.sizes, args.repeat, args.processes, args.depth, args.fan_out, args.results)
@@ -0,0 +1,92 @@
+from structure import Structure
+
+
+def record_keys(record, ignored_parents):
+    """
+    Returns the groupIds and artifactIds the pom is assigned by, i.e. every id used to look up or record anything for the pom
+    in the structure, as 'group:<groupId>' and 'artifact:<artifactId>'. A pom with an ignored parent is only assigned by its own
+    ids. Poms that do not share any key can be assigned independently of each other.
+    :param record: The PomRecord of the pom.
+    :param ignored_parents: The parent artifactIds that makes a pom a parent pom.
+    :return: A list of keys, the first key is always there.
+    """
+    if record.parent_artifact_id is None or record.parent_artifact_id in ignored_parents:
+        group_ids = [created_package(record, ignored_parents)]
+        artifact_ids = [record.artifact_id]
+    else:
+        group_ids = [record.group_id, record.parent_group_id]
+        artifact_ids = [record.artifact_id, record.parent_artifact_id]
+    return ['artifact:' + artifact_id for artifact_id in artifact_ids] + \
+        ['group:' + group_id for group_id in group_ids if group_id is not None]
+
+
+def created_package(record, ignored_parents):
+    """ Returns the package the pom creates if it is a parent pom, or None. """
+    if record.parent_artifact_id is None or record.parent_artifact_id in ignored_parents:
+        return record.parent_group_id if record.group_id is None else record.group_id
+    return None
+
+
+def group_by_keys(keys_of_items):
+    """
+    Splits items into components, where two items are in the same component if they share a key, directly or through other
+    items, using union-find over the keys.
+    :param keys_of_items: The keys of every item, each item must have at least one key.
+    :return: The components as lists of the indexes of their items, in order of their first item.
+    """
+    parents = {}
+
+    def find(key):
+        root = key
+        while parents.setdefault(root, root) != root:
+            root = parents[root]
+        while key != root:
+            parents[key], key = root, parents[key]
+        return root
+
+    for keys in keys_of_items:
+        for key in keys[1:]:
+            parents[find(key)] = find(keys[0])
+
+    components = {}
+    for i, keys in enumerate(keys_of_items):
+        components.setdefault(find(keys[0]), []).append(i)
+    return list(components.values())
+
+
+def rank_packages(ranked_records, ignored_parents):
+    """
+    Returns the packages created by the poms of a component, each with the rank of the first pom creating it.
+    :param ranked_records: The (rank, PomRecord) of the poms, in order of their rank.
+    :param ignored_parents: The parent artifactIds that makes a pom a parent pom.
+    :return: A dictionary of package -> rank.
+    """
+    package_ranks = {}
+    for rank, record in ranked_records:
+        package = created_package(record, ignored_parents)
+        if package is not None:
+            package_ranks.setdefault(package, rank)
+    return package_ranks
+
+
+def merge_components(components):
+    """
+    Merges the structures of independent components into one structure, with the packages in the order a run over all poms
+    creates them. The modules are shared with the components, but the packages are copied, so the structure can be written by
+    run.write_outputs without changing the components.
+    :param components: The (rank of the first pom, packages, package ranks, dependency map) of every component, where the
+    package ranks map every package to the rank of the first pom creating it.
+    :return: The merged Structure.
+    """
+    merged = Structure()
+    ranked_packages = sorted(((rank, package, packages, dependency_map) for _, packages, package_ranks, dependency_map
+                              in components for package, rank in package_ranks.items()), key=lambda ranked: ranked[0])
+    for _, package, packages, dependency_map in ranked_packages:
+        merged.obj[package] = dict(packages[package])
+        if package in dependency_map:
+            merged.dependency_map[package] = dependency_map[package]
+    # The dependency map also has groupIds that are not packages, those are added per component.
+    for _, _, _, dependency_map in sorted(components, key=lambda component: component[0]):
+        for key, val in dependency_map.items():
+            merged.dependency_map.setdefault(key, val)
+    return merged
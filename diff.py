@@ -0,0 +1,159 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+from structure_hash import file_digest, hash_structure, module_keys
+
+# The columns of the change report, every change is one row.
+change_fields = ['change', 'package', 'module', 'dependency', 'old_version', 'new_version']
+
+
+def load_build(structure_path):
+    """
+    Loads the hashes of a build from the structure_hashes.json file next to its structure.json, or computes them from the
+    structure if the build has none, or the digest of structure.json in its hashes is not that of this structure.json.
+    :param structure_path: The path of the structure.json file of the build.
+    :return: The hashes, and a function returning a package of the structure as a dictionary, which with the hashes of the
+    build only reads that package from structure.json.
+    """
+    hashes_path = os.path.join(os.path.dirname(structure_path), 'structure_hashes.json')
+    if os.path.exists(hashes_path):
+        with open(hashes_path) as hashes_input:
+            hashes = json.load(hashes_input)
+        if hashes.get('digest') == file_digest(structure_path):
+            def load_package(package):
+                offset, length = hashes['packages'][package]['at']
+                with open(structure_path, 'rb') as structure_input:
+                    structure_input.seek(offset)
+                    return json.loads(structure_input.read(length))
+            return hashes, load_package
+        logging.info(f'The structure_hashes.json next to {structure_path} is not of that structure.json, the hashes are '
+                     f'computed from the structure.')
+    else:
+        logging.info(f'No structure_hashes.json next to {structure_path}, the hashes are computed from the structure.')
+    with open(structure_path) as structure_input:
+        structure = json.load(structure_input)
+    return hash_structure((key, val['modules']) for key, val in structure.items()), structure.__getitem__
+
+
+def diff_builds(old_path, new_path):
+    """
+    Compares two builds, descending only into the packages and modules whose hashes differ. Only the packages that changed are
+    read from the structure.json files.
+    :param old_path: The path of the structure.json file of the old build.
+    :param new_path: The path of the structure.json file of the new build.
+    :return: A list of changes, each a dictionary with the change_fields.
+    """
+    old_hashes, load_old = load_build(old_path)
+    new_hashes, load_new = load_build(new_path)
+    if old_hashes['hash'] == new_hashes['hash']:
+        return []
+    return diff_structures(load_old, load_new, old_hashes, new_hashes)
+
+
+def diff_structures(old, new, old_hashes, new_hashes):
+    """
+    Finds the packages and modules that were added or removed, and the modules whose version or dependencies changed.
+    :param old: A function returning a package of the old structure, e.g. dict.__getitem__ of the structure dictionary.
+    :param new: A function returning a package of the new structure.
+    :param old_hashes: The Merkle tree of the old structure, see hash_structure.
+    :param new_hashes: The Merkle tree of the new structure.
+    :return: A list of changes, each a dictionary with the change_fields. Modules are given by their path in the package,
+    e.g. 'parent/child'.
+    """
+    changes = []
+    old_packages, new_packages = old_hashes['packages'], new_hashes['packages']
+    for package in sorted(old_packages.keys() | new_packages.keys()):
+        if package not in new_packages:
+            changes.append(__change('removed_package', package))
+            for key, module in module_keys(old(package)['modules']).items():
+                __module_changed(changes, 'removed_module', package, key, module)
+        elif package not in old_packages:
+            changes.append(__change('added_package', package))
+            for key, module in module_keys(new(package)['modules']).items():
+                __module_changed(changes, 'added_module', package, key, module)
+        elif old_packages[package]['hash'] != new_packages[package]['hash']:
+            __diff_modules(changes, package, '', old(package)['modules'], new(package)['modules'],
+                           old_packages[package]['modules'], new_packages[package]['modules'])
+    logging.info(f'Found {len(changes)} changes between the builds.')
+    return changes
+
+
+def __diff_modules(changes, package, prefix, old_modules, new_modules, old_nodes, new_nodes):
+    """ Adds the changes between two lists of modules on the same level, skipping the subtrees with the same hash. """
+    old_modules, new_modules = module_keys(old_modules), module_keys(new_modules)
+    for key in sorted(old_nodes.keys() | new_nodes.keys()):
+        if key not in new_nodes:
+            __module_changed(changes, 'removed_module', package, prefix + key, old_modules[key])
+            continue
+        if key not in old_nodes:
+            __module_changed(changes, 'added_module', package, prefix + key, new_modules[key])
+            continue
+        if old_nodes[key]['hash'] == new_nodes[key]['hash']:
+            continue
+        old_module, new_module = old_modules[key], new_modules[key]
+        path = prefix + key
+        if old_nodes[key]['own'] != new_nodes[key]['own']:
+            if old_module['version'] != new_module['version']:
+                changes.append(__change('changed_version', package, path, None, old_module['version'], new_module['version']))
+            old_dependencies, new_dependencies = old_module['dependencies'], new_module['dependencies']
+            for dependency in sorted(old_dependencies.keys() | new_dependencies.keys()):
+                if dependency not in new_dependencies:
+                    changes.append(__change('removed_dependency', package, path, dependency, old_dependencies[dependency]))
+                elif dependency not in old_dependencies:
+                    changes.append(__change('added_dependency', package, path, dependency, None, new_dependencies[dependency]))
+                elif old_dependencies[dependency] != new_dependencies[dependency]:
+                    changes.append(__change('changed_dependency', package, path, dependency, old_dependencies[dependency],
+                                            new_dependencies[dependency]))
+        __diff_modules(changes, package, path + '/', old_module['modules'], new_module['modules'], old_nodes[key]['modules'],
+                       new_nodes[key]['modules'])
+
+
+def __module_changed(changes, change, package, path, module):
+    """ Adds a change for the module and every module in its subtree, which were all either added or removed. """
+    versions = (module['version'], None) if change == 'removed_module' else (None, module['version'])
+    changes.append(__change(change, package, path, None, *versions))
+    for key, child in module_keys(module['modules']).items():
+        __module_changed(changes, change, package, path + '/' + key, child)
+
+
+def __change(change, package, module=None, dependency=None, old_version=None, new_version=None):
+    """ Returns a row of the change report. """
+    return {'change': change, 'package': package, 'module': module, 'dependency': dependency, 'old_version': old_version,
+            'new_version': new_version}
+
+
+def write_changes(changes, file_type, output):
+    """
+    Writes the change report.
+    :param changes: The changes found by diff_builds.
+    :param file_type: Either 'json' or 'csv'.
+    :param output: The file object to write to.
+    """
+    if file_type == 'csv':
+        writer = csv.DictWriter(output, fieldnames=change_fields)
+        writer.writeheader()
+        writer.writerows(changes)
+    else:
+        json.dump(changes, output, indent=2)
+        output.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reports the changes between two builds of structure.json, e.g. the previous '
+                                                 'and the current nightly run.')
+    parser.add_argument('old', help='The structure.json of the old build.')
+    parser.add_argument('new', help='The structure.json of the new build.')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json', help='The format of the report, by default json.')
+    parser.add_argument('--output', help='The file to write the report to, by default standard output.')
+    args = parser.parse_args()
+
+    report = diff_builds(args.old, args.new)
+    if args.output:
+        with open(args.output, 'w', newline='' if args.format == 'csv' else None) as report_output:
+            write_changes(report, args.format, report_output)
+    else:
+        write_changes(report, args.format, sys.stdout)
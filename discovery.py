@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def walk_poms(path='releases/', threads=1):
+    """
+    Finds every pom.xml under the given path in a single walk using os.scandir, which gives the size and mtime of the poms without
+    reading the directories again. Any directory containing a pom.xml is recognized, whatever other files it contains. The
+    directories under the top level are walked in parallel by the given number of threads, which mostly helps on network file
+    systems, where most of the time is spent waiting for directory listings.
+    :param path: The path to find poms in.
+    :param threads: The number of threads walking the top-level directories.
+    :return: A list of (path, size, mtime_ns) of every pom, in the order os.walk would find them regardless of the number of
+    threads, and a list of (path, mtime_ns) of every directory walked.
+    """
+    poms, directories, walked = __scan(path)
+    if threads > 1 and len(directories) > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            walks = list(executor.map(__walk, directories))
+    else:
+        walks = [__walk(directory) for directory in directories]
+    for found, walked_below in walks:
+        poms += found
+        walked += walked_below
+    return poms, walked
+
+
+def __walk(top):
+    """ Walks the directory top-down, as os.walk does, and returns the poms found and the directories walked. """
+    poms, walked, stack = [], [], [top]
+    while stack:
+        directory = stack.pop()
+        found, directories, scanned = __scan(directory)
+        poms += found
+        walked += scanned
+        stack.extend(reversed(directories))
+    return poms, walked
+
+
+def __scan(directory):
+    """
+    Lists the directory, returning its pom as a list of (path, size, mtime_ns), the directories to walk into, and the directory
+    itself as a list of (path, mtime_ns). The mtime is read before the directory is listed, so a change made while it is listed
+    is noticed later. Symbolic links to directories are not walked into, and directories that can not be listed are skipped, as
+    by os.walk.
+    """
+    poms, directories = [], []
+    try:
+        scanned = [(directory, os.stat(directory).st_mtime_ns)]
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                    if is_dir and not entry.is_symlink():
+                        directories.append(os.path.join(directory, entry.name))
+                    elif not is_dir and entry.name == 'pom.xml':
+                        stat = entry.stat()
+                        poms.append((os.path.join(directory, entry.name), stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    continue
+    except OSError:
+        return [], [], []
+    return poms, directories, scanned
+
+
+class PomManifest:
+    """
+    The poms found under a directory, with the size and mtime of every pom, persisted to a .json file. run.py writes it when it
+    walks the directory, and download.py adds the poms it downloads, so later runs can read the poms from the manifest instead of
+    walking the directory. The mtime of every directory walked is also kept, as adding or removing a pom changes the mtime of its
+    directory, and the manifest is only used while those mtimes are the same. The paths are stored relative to the directory.
+    """
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = os.path.normpath(root)
+        self.lock = threading.Lock()
+        # Relative path -> (size, mtime_ns), None if there is no manifest of the root.
+        self.entries = None
+        # Relative path of every directory walked -> mtime_ns.
+        self.directories = {}
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest['root'] != self.root:
+                logging.info(f'The pom manifest {path} is of {manifest["root"]}, not {self.root}, so it is not used.')
+            elif 'directories' not in manifest:
+                logging.info(f'The pom manifest {path} has no mtimes of the directories, so it is not used.')
+            else:
+                self.entries = {relative: (size, mtime_ns) for relative, size, mtime_ns in manifest['poms']}
+                self.directories = dict(manifest['directories'])
+
+    def poms(self, root):
+        """
+        Returns the poms in the manifest as (path, size, mtime_ns), with the paths joined to the given root, which must be the
+        directory of the manifest. Every directory and pom is stat'ed, and the current size and mtime of the poms are returned.
+        :return: The poms, or None if there is no manifest, or if a directory has changed or a pom is gone since the manifest was
+        written, in which case the directory must be walked again.
+        """
+        if self.entries is None:
+            return None
+        for relative, mtime_ns in self.directories.items():
+            try:
+                if os.stat(os.path.join(root, relative)).st_mtime_ns == mtime_ns:
+                    continue
+            except OSError:
+                pass
+            logging.info(f'The directory {os.path.normpath(os.path.join(root, relative))} has changed since the pom manifest {self.path} was '
+                         f'written, so it is not used.')
+            return None
+        poms = []
+        for relative in self.entries:
+            pom_path = os.path.join(root, relative)
+            try:
+                stat = os.stat(pom_path)
+            except OSError:
+                logging.info(f'The pom {pom_path} in the pom manifest {self.path} is gone, so the manifest is not used.')
+                return None
+            poms.append((pom_path, stat.st_size, stat.st_mtime_ns))
+        return poms
+
+    def replace(self, poms, directories):
+        """
+        Replaces the poms in the manifest with the given (path, size, mtime_ns) found by walking the directory, and the directories
+        with the given (path, mtime_ns) of every directory walked.
+        """
+        with self.lock:
+            self.entries = {os.path.relpath(path, self.root): (size, mtime_ns) for path, size, mtime_ns in poms}
+            self.directories = {os.path.relpath(path, self.root): mtime_ns for path, mtime_ns in directories}
+
+    def add(self, pom_path):
+        """
+        Adds the pom, or updates its size and mtime, if there is a manifest of the directory. For a pom that is new to the manifest
+        the mtimes of the directories from the pom up to the root are updated too, as writing the pom changed them. Without a
+        manifest nothing is done, as the poms that were not added would be missing from it.
+        """
+        stat = os.stat(pom_path)
+        with self.lock:
+            if self.entries is None:
+                return
+            relative = os.path.relpath(pom_path, self.root)
+            new = relative not in self.entries
+            self.entries[relative] = (stat.st_size, stat.st_mtime_ns)
+            directory = os.path.dirname(pom_path)
+            while new:
+                relative = os.path.relpath(directory, self.root)
+                if relative.startswith(os.pardir):
+                    break
+                self.directories[relative] = os.stat(directory).st_mtime_ns
+                new = relative != os.curdir
+                directory = os.path.dirname(directory)
+
+    def save(self):
+        """ Writes the manifest, if there is one. """
+        with self.lock:
+            if self.entries is None:
+                return
+            with open(self.path + '.tmp', 'w') as manifest_file:
+                json.dump({'root': self.root, 'poms': [[relative, size, mtime_ns] for relative, (size, mtime_ns)
+                                                       in self.entries.items()],
+                           'directories': [[relative, mtime_ns] for relative, mtime_ns in self.directories.items()]},
+                          manifest_file)
+            os.replace(self.path + '.tmp', self.path)
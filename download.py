@@ -1,20 +1,38 @@
+import argparse
+import hashlib
+import json
 import logging
 import os
+import threading
 import xml.etree.ElementTree as xml
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from configparser import ConfigParser
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from urllib.parse import urljoin, urlparse
 
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-ignored_parents = ["sbforge-parent", "sbprojects-parent", "oss-parent"]
+from discovery import PomManifest
+from pom_store import PomStore
+from utility import version_key
 
 config = ConfigParser()
 config.read("config.conf")
 NEXUS_RELEASES_BASE_URL = config.get("nexus_crawl", "releases_base_url")
 CRAWL_OUTPUT_DIR = config.get("nexus_crawl", "output_dir")
+CRAWL_CONCURRENCY = config.getint("nexus_crawl", "concurrency")
+CRAWL_PER_HOST_LIMIT = config.getint("nexus_crawl", "per_host_limit")
+CRAWL_RETRIES = config.getint("nexus_crawl", "retries")
+CRAWL_BACKOFF_FACTOR = config.getfloat("nexus_crawl", "backoff_factor")
+SYNC_MANIFEST = config.get("nexus_crawl", "sync_manifest")
 DIR_TRAVERSAL_BASE_DIR = config.get("dir_traversal", "base_dir")
 DIR_TRAVERSAL_OUTPUT_DIR = config.get("dir_traversal", "output_dir")
+POM_STORE = config.get("pom_store", "path")
+POM_MANIFEST = config.get("worker", "pom_manifest")
 
 LOGGING_LEVEL = config.get("all", "logging_level").upper()
 logging.basicConfig(
@@ -26,43 +44,130 @@ xml.register_namespace('', URL)
 tree = xml.ElementTree()
 
 visited = set()
+visited_lock = threading.Lock()
+
+# A single session is shared by all requests, so connections are pooled and reused. Failed requests are retried with backoff.
+session = requests.Session()
+
+
+def __mount_adapter(concurrency):
+    """ Mounts the retrying adapter on the session, with a connection pool per host for the given number of workers. """
+    adapter = HTTPAdapter(pool_maxsize=max(1, concurrency), max_retries=Retry(
+        total=CRAWL_RETRIES, backoff_factor=CRAWL_BACKOFF_FACTOR, status_forcelist=(429, 500, 502, 503, 504)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+__mount_adapter(CRAWL_CONCURRENCY)
+
+host_limits = {}
+host_limits_lock = threading.Lock()
+
+# 'artifacts' maps the url of every artifact ID found to its local directory, and 'urls' maps the url of every metadata file and
+# pom downloaded to its ETag, Last-Modified and, for poms, the sha256 of the content.
+manifest = {'artifacts': {}, 'urls': {}}
+manifest_lock = threading.Lock()
+
+# The store every version of the poms is downloaded to, if all versions are downloaded, and the directory the poms are downloaded
+# to, which the artifacts in the store are relative to.
+store = None
+output_dir = CRAWL_OUTPUT_DIR
+# The manifest of the poms in the output directory, kept up to date with the poms downloaded so run.py does not need to walk it.
+pom_manifest = None
+
+
+def __get_host_limit(url):
+    """ Returns the semaphore limiting the number of concurrent requests to the host of the url. """
+    host = urlparse(url).netloc
+    with host_limits_lock:
+        if host not in host_limits:
+            host_limits[host] = threading.BoundedSemaphore(CRAWL_PER_HOST_LIMIT)
+        return host_limits[host]
 
 
 def __get_html(url):
     """ Make a GET request to the url and return the html content. """
-    return requests.get(url).text
+    with __get_host_limit(url):
+        return session.get(url).text
 
 
 def __get_links_at_url(url):
-    """ Generator returning links (href) from <a> tags at a given url one by one. """
+    """ Generator returning the absolute links (href) from <a> tags at a given url one by one, skipping the parent link. """
     html = __get_html(url)
     soup = BeautifulSoup(html, 'html.parser')
     for link_tag in soup.find_all('a'):
-        yield link_tag.get('href')
+        href = link_tag.get('href')
+        if href and href != '../':
+            yield urljoin(url, href)
+
+
+def __conditional_get(url, conditional=True):
+    """ Make a GET request to the url. If conditional, the ETag and Last-Modified from the last time the url was downloaded are
+    sent along, so the response is 304 Not Modified if nothing has changed. """
+    headers = {}
+    if conditional:
+        with manifest_lock:
+            entry = manifest['urls'].get(url, {})
+        if 'etag' in entry:
+            headers['If-None-Match'] = entry['etag']
+        if 'last_modified' in entry:
+            headers['If-Modified-Since'] = entry['last_modified']
+    with __get_host_limit(url):
+        return session.get(url, headers=headers)
+
+
+def __remember(url, response, **values):
+    """ Records the ETag and Last-Modified of the response in the manifest, together with the given values. """
+    entry = dict(values)
+    if 'ETag' in response.headers:
+        entry['etag'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        entry['last_modified'] = response.headers['Last-Modified']
+    with manifest_lock:
+        manifest['urls'][url] = entry
 
 
 def __download_pom(url, destination_dir):
-    """ Downloads the pom content at the given url and writes it to pom.xml under the given destination directory.
+    """ Downloads the pom content at the given url and writes it to pom.xml under the given destination directory, unless
+    the pom has not changed since it was last downloaded.
     The given url is expected to link directly to the content of a pom file, i.e.
     https://example-nexus.com/org/project/artifact-id/1.0.0/artifact_id-1.0.0.pom """
-    logging.info(f'Writing pom to: {destination_dir}')
-    pom_content = __get_html(url)
-    Path(destination_dir).mkdir(parents=True, exist_ok=True)
     pom_path = os.path.join(destination_dir, "pom.xml")
-    with open(pom_path, 'w+') as pom:
-        pom.write(pom_content)
+    exists = os.path.exists(pom_path)
+    response = __conditional_get(url, exists)
+    if response.status_code == 304:
+        logging.debug(f'Pom not modified: {url}')
+        if pom_manifest is not None:
+            pom_manifest.add(pom_path)
+        return
+    response.raise_for_status()
+
+    sha256 = hashlib.sha256(response.content).hexdigest()
+    with manifest_lock:
+        unchanged = exists and manifest['urls'].get(url, {}).get('sha256') == sha256
+    if not unchanged:
+        logging.info(f'Writing pom to: {destination_dir}')
+        Path(destination_dir).mkdir(parents=True, exist_ok=True)
+        with open(pom_path, 'wb') as pom:
+            pom.write(response.content)
+    if pom_manifest is not None:
+        pom_manifest.add(pom_path)
+    __remember(url, response, sha256=sha256)
 
 
 def __get_newest_pom(artifact_id_url, destination_dir):
-    """ Given a nexus url at the artifact ID level, i.e. https://example-nexus.com/org/project/artifact-id,
+    """ Given a nexus url at the artifact ID level, i.e. https://example-nexus.com/org/project/artifact-id/,
     downloads the project's newest version pom to the specified destination dir. """
     versions = []
 
     for link_url in __get_links_at_url(artifact_id_url):
-        if link_url != '../' and link_url.endswith('/'):
+        if link_url.endswith('/'):
             versions.append(link_url)
 
-    newest_version_url = sorted(versions, reverse=True)[0]
+    newest_version_url = max(versions, key=lambda version_url: version_key(os.path.basename(version_url[:-1])), default=None)
+    if newest_version_url is None:
+        logging.warning(f'No versions found for {artifact_id_url}, it is skipped.')
+        return
 
     for link_url in __get_links_at_url(newest_version_url):
         if link_url.endswith('.pom'):  # Only 1 should exist so just grab that
@@ -70,36 +175,210 @@ def __get_newest_pom(artifact_id_url, destination_dir):
             # Pom-containing dir can contain .xml files and stuff, so doesn't hurt to skip checking them by breaking
             break
 
+    if store is not None:
+        __store_versions(artifact_id_url, destination_dir, [os.path.basename(version_url[:-1]) for version_url in versions])
+
+
+def __store_versions(artifact_id_url, destination_dir, versions):
+    """ Downloads the pom of every version of the artifact that is not in the pom store yet to the store. The time a version
+    was released is taken from the Last-Modified of its pom. """
+    artifact = os.path.relpath(destination_dir, output_dir)
+    artifact_id = os.path.basename(artifact_id_url[:-1])
+    for version in sorted(set(versions) - store.versions(artifact), key=version_key):
+        url = f'{artifact_id_url}{version}/{artifact_id}-{version}.pom'
+        with __get_host_limit(url):
+            response = session.get(url)
+        if response.status_code == 404:
+            logging.debug(f'No pom for version: {url}')
+            continue
+        response.raise_for_status()
+        released = None
+        if 'Last-Modified' in response.headers:
+            released = parsedate_to_datetime(response.headers['Last-Modified']).timestamp()
+        store.add_version(artifact, version, response.content, released)
+        logging.debug(f'Stored pom: {url}')
+
+
+def __sync_artifact(artifact_id_url, destination_dir):
+    """ Given a nexus url at the artifact ID level, i.e. https://example-nexus.com/org/project/artifact-id/, downloads the pom of
+    the latest release found in the artifact's maven-metadata.xml to the specified destination dir. Nothing more is downloaded
+    if the metadata has not changed since the last sync.
+    :return: False if the maven-metadata.xml is missing or does not describe the versions of an artifact, True otherwise. """
+    metadata_url = artifact_id_url + 'maven-metadata.xml'
+    with manifest_lock:
+        known = artifact_id_url in manifest['artifacts']
+    if store is not None and not store.versions(os.path.relpath(destination_dir, output_dir)):
+        # The metadata is downloaded again for artifacts with no versions in the store yet.
+        known = False
+    response = __conditional_get(metadata_url, known and os.path.exists(os.path.join(destination_dir, 'pom.xml')))
+    if response.status_code == 304:
+        logging.debug(f'Metadata not modified: {metadata_url}')
+        return True
+    if response.status_code != 200:
+        return False
+
+    try:
+        metadata = xml.fromstring(response.content)
+    except xml.ParseError as error:
+        logging.warning(f'Could not parse {metadata_url}, the versions are listed instead: {error}')
+        return False
+    versions = [version.text for version in metadata.iterfind('versioning/versions/version')]
+    release = metadata.findtext('versioning/release') or metadata.findtext('versioning/latest') or \
+        max(versions, key=version_key, default=None)
+    if not release:
+        return False
+
+    artifact_id = metadata.findtext('artifactId')
+    __download_pom(f'{artifact_id_url}{release}/{artifact_id}-{release}.pom', destination_dir)
+    if store is not None:
+        __store_versions(artifact_id_url, destination_dir, versions)
+    # Only remembered once the pom is downloaded, so a failed download is retried on the next sync.
+    __remember(metadata_url, response)
+    with manifest_lock:
+        manifest['artifacts'][artifact_id_url] = destination_dir
+    return True
+
+
+def __sync_known_artifacts(workers):
+    """ Syncs every artifact recorded in the manifest, without crawling nexus. Artifacts without a maven-metadata.xml are
+    synced by listing their versions instead. An artifact that fails to sync for any reason is logged and skipped. """
+    def sync(item):
+        artifact_id_url, destination_dir = item
+        try:
+            if not __sync_artifact(artifact_id_url, destination_dir):
+                __get_newest_pom(artifact_id_url, destination_dir)
+        except Exception as error:
+            # The metadata is only remembered once the pom is downloaded, so the artifact is tried again on the next sync.
+            logging.warning(f'Could not sync {artifact_id_url}, it is skipped: {error!r}')
+
+    with manifest_lock:
+        artifacts = list(manifest['artifacts'].items())
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(sync, artifacts))
+
+
+def __load_manifest(path):
+    """ Loads the sync manifest from the given path, if it exists. """
+    if os.path.exists(path):
+        with open(path) as manifest_file:
+            manifest.update(json.load(manifest_file))
+
+
+def __save_manifest(path):
+    """ Writes the sync manifest to the given path. """
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(path + '.tmp', path)
+
 
 def __crawl_nexus(url, path):
     """ Recursively crawls nexus from the given url, building an equivalent folder structure to nexus from
-    the provided path and downloading pom files to their respective project folders. """
+    the provided path and downloading pom files to their respective project folders. A directory that fails to crawl for any
+    reason is logged and skipped, without stopping the crawl. """
+    try:
+        subdirectories = __crawl_directory(url, path)
+    except Exception as error:
+        logging.warning(f'Could not crawl {url}, it is skipped: {error!r}')
+        return
+    for link_url, new_path in subdirectories:
+        __crawl_nexus(link_url, new_path)
+
+
+def __crawl_nexus_concurrently(url, path, workers):
+    """ Crawls nexus from the given url like __crawl_nexus, but lists the directories and downloads the poms using a pool of
+    worker threads. Every directory found is crawled as its own task, so the levels of the repository are not waiting on
+    each other. A directory that fails to crawl for any reason is logged and skipped, without stopping the crawl. """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(__crawl_directory, url, path): url}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                crawled_url = pending.pop(future)
+                try:
+                    subdirectories = future.result()
+                except Exception as error:
+                    logging.warning(f'Could not crawl {crawled_url}, it is skipped: {error!r}')
+                    continue
+                for link_url, new_path in subdirectories:
+                    pending[executor.submit(__crawl_directory, link_url, new_path)] = link_url
+
+
+def __crawl_directory(url, path):
+    """ Crawls a single directory on nexus. If the directory contains a pom, the newest pom of the artifact is downloaded.
+    Returns a list of (url, path) for the subdirectories that should be crawled next. """
     logging.debug(f'Crawling: {url}')
-    for link_url in __get_links_at_url(url):
-        # Need to check if folder contains version numbers and then just check latest.
+    links = list(__get_links_at_url(url))
+    # A directory with a maven-metadata.xml is an artifact, and the versions can be read from the metadata without listing them.
+    if url + 'maven-metadata.xml' in links and url[:-1] not in visited and __sync_artifact(url, path):
+        with visited_lock:
+            visited.add(url[:-1])
+        return []
 
-        if link_url == '../':  # Don't go back
-            continue
-        elif link_url.endswith('/'):
+    subdirectories = []
+    for link_url in links:
+        # Need to check if folder contains version numbers and then just check latest.
+        if link_url.endswith('/'):
             parent_url = os.path.dirname(link_url[:-1])
             if parent_url not in visited:
-                # print(os.path.dirname(link_url), link_url)
                 current_link_dir = os.path.basename(link_url[:-1])
-                new_path = os.path.join(path, current_link_dir)
-                __crawl_nexus(link_url, new_path)
+                subdirectories.append((link_url, os.path.join(path, current_link_dir)))
         elif link_url.endswith('.pom'):
             local_artifact_dir = os.path.dirname(path)
 
             version_url = os.path.dirname(link_url)
             artifact_id_url = os.path.dirname(version_url)
-            visited.add(artifact_id_url)
+            # Other version directories of the artifact may be crawled at the same time, only the first one downloads the pom.
+            with visited_lock:
+                if artifact_id_url in visited:
+                    return []
+                visited.add(artifact_id_url)
 
-            __get_newest_pom(artifact_id_url, local_artifact_dir)
-            # Again pom-containing dir contains other stuff, but we're done now, so break
-            break
+            __get_newest_pom(artifact_id_url + '/', local_artifact_dir)
+            with manifest_lock:
+                manifest['artifacts'][artifact_id_url + '/'] = local_artifact_dir
+            # Again pom-containing dir contains other stuff, but we're done now, so return
+            return []
+    return subdirectories
 
 
 if __name__ == "__main__":
-    Path("releases").mkdir(exist_ok=True)
-    nexus_url = "https://sbforge.org/nexus/content/repositories/releases"
-    __crawl_nexus(nexus_url, 'releases')
+    parser = argparse.ArgumentParser(description='Downloads the newest pom of every project on nexus.')
+    parser.add_argument('--url', default=NEXUS_RELEASES_BASE_URL, help='The nexus repository to crawl, by default '
+                                                                       '[nexus_crawl] releases_base_url.')
+    parser.add_argument('--output-dir', default=CRAWL_OUTPUT_DIR, help='The directory to download the poms to, by default '
+                                                                       '[nexus_crawl] output_dir.')
+    parser.add_argument('--concurrency', type=int, default=CRAWL_CONCURRENCY,
+                        help='The number of concurrent crawl workers, by default [nexus_crawl] concurrency. 1 crawls serially.')
+    parser.add_argument('--sync', action='store_true',
+                        help='Only check the artifacts recorded in the sync manifest for new poms, instead of crawling nexus.')
+    parser.add_argument('--manifest', default=SYNC_MANIFEST, help='The sync manifest, by default [nexus_crawl] sync_manifest.')
+    parser.add_argument('--all-versions', action='store_true',
+                        help='Also download the pom of every version of every artifact to the pom store.')
+    parser.add_argument('--store', default=POM_STORE, help='The pom store, by default [pom_store] path.')
+    parser.add_argument('--pom-manifest', default=POM_MANIFEST,
+                        help='The manifest of the poms written by run.py, by default [worker] pom_manifest. The poms downloaded '
+                             'are added to it, if it exists. Use an empty string to leave it as it is.')
+    args = parser.parse_args()
+
+    __mount_adapter(args.concurrency)
+    Path(args.output_dir).mkdir(exist_ok=True)
+    output_dir = args.output_dir
+    if args.all_versions:
+        store = PomStore(args.store)
+    if args.pom_manifest:
+        pom_manifest = PomManifest(args.pom_manifest, args.output_dir)
+    nexus_url = args.url if args.url.endswith('/') else args.url + '/'
+    __load_manifest(args.manifest)
+    try:
+        if args.sync:
+            __sync_known_artifacts(args.concurrency)
+        elif args.concurrency > 1:
+            __crawl_nexus_concurrently(nexus_url, args.output_dir, args.concurrency)
+        else:
+            __crawl_nexus(nexus_url, args.output_dir)
+    finally:
+        __save_manifest(args.manifest)
+        if pom_manifest is not None:
+            pom_manifest.save()
+        if store is not None:
+            store.close()
@@ -0,0 +1,232 @@
+import argparse
+import html
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from run import setup_logging
+from utility import version_key
+
+# The versions every artifact of the fake nexus is released in, the newest being the release.
+VERSIONS = ['1.2', '1.9', '1.10']
+
+
+def build_nexus(poms_path, nexus_path, versions=VERSIONS, missing=0, broken=0):
+    """
+    Lays out the poms of a directory like releases/ as a nexus repository, with a directory per version of every artifact holding
+    the pom and a jar, and a maven-metadata.xml listing the versions. Every version of a pom ends with a comment naming the
+    version, so the version downloaded can be told from its content.
+    :param poms_path: The path of the poms, e.g. a corpus written by generate_corpus.py.
+    :param nexus_path: The directory the repository is written to.
+    :param versions: The versions of every artifact.
+    :param missing: The number of artifacts whose release pom is left out, so downloading them fails with 404 Not Found.
+    :param broken: The number of artifacts, after the missing ones, whose maven-metadata.xml is an html page instead, so their
+    versions must be listed.
+    :return: A dictionary of the path of every artifact relative to the repository -> the content of its pom.xml, None for the
+    artifacts whose release pom is missing.
+    """
+    release = max(versions, key=version_key)
+    artifacts = {}
+    for root, _, files in os.walk(poms_path):
+        if 'pom.xml' not in files:
+            continue
+        artifact = os.path.relpath(root, poms_path)
+        artifact_id = os.path.basename(root)
+        with open(os.path.join(root, 'pom.xml'), 'rb') as pom:
+            content = pom.read()
+        for version in versions:
+            version_dir = os.path.join(nexus_path, artifact, version)
+            os.makedirs(version_dir, exist_ok=True)
+            if version != release or len(artifacts) >= missing:
+                with open(os.path.join(version_dir, f'{artifact_id}-{version}.pom'), 'wb') as pom:
+                    pom.write(version_pom(content, version))
+            with open(os.path.join(version_dir, f'{artifact_id}-{version}.jar'), 'wb') as jar:
+                jar.write(b'jar')
+        if len(artifacts) < missing or len(artifacts) >= missing + broken:
+            write_metadata(os.path.join(nexus_path, artifact), artifact_id, versions)
+        else:
+            with open(os.path.join(nexus_path, artifact, 'maven-metadata.xml'), 'w') as metadata:
+                metadata.write('<html><body><p>Service Unavailable<br></body></html>')
+        artifacts[artifact] = content if len(artifacts) >= missing else None
+    return artifacts
+
+
+def version_pom(content, version):
+    """ Returns the content of the pom of the given version. """
+    return content + f'<!-- {version} -->\n'.encode()
+
+
+def write_metadata(artifact_dir, artifact_id, versions):
+    """ Writes the maven-metadata.xml of an artifact with the given versions. """
+    release = max(versions, key=version_key)
+    with open(os.path.join(artifact_dir, 'maven-metadata.xml'), 'w') as metadata:
+        metadata.write(f'<metadata><artifactId>{artifact_id}</artifactId><versioning><latest>{release}</latest>'
+                       f'<release>{release}</release><versions>'
+                       + ''.join(f'<version>{version}</version>' for version in versions)
+                       + '</versions></versioning></metadata>')
+
+
+class FakeNexusHandler(SimpleHTTPRequestHandler):
+    """
+    Serves a directory like nexus 2 does: directories as html listings with absolute links and a '../' parent link, and files
+    with an ETag and Last-Modified, answering conditional requests with 304 Not Modified.
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.endswith('/'):
+                self.send_response(301)
+                self.send_header('Location', self.path + '/')
+                self.end_headers()
+                return
+            url = f'http://{self.headers["Host"]}{self.path}'
+            links = ['<a href="../">Parent Directory</a>'] + \
+                [f'<a href="{html.escape(url + name)}{"/" if os.path.isdir(os.path.join(path, name)) else ""}">{html.escape(name)}</a>'
+                 for name in sorted(os.listdir(path))]
+            self.__send(200, ('<html><body>' + '\n'.join(links) + '</body></html>').encode(), {'Content-Type': 'text/html'})
+        elif os.path.isfile(path):
+            stat = os.stat(path)
+            etag = f'"{stat.st_mtime_ns}-{stat.st_size}"'
+            # As in HTTP, If-Modified-Since is only used when no If-None-Match is sent.
+            if_none_match, if_modified_since = self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')
+            if if_none_match == etag if if_none_match else \
+                    if_modified_since and parsedate_to_datetime(if_modified_since).timestamp() >= int(stat.st_mtime):
+                self.__send(304, b'', {})
+                return
+            with open(path, 'rb') as served:
+                content = served.read()
+            self.__send(200, content, {'ETag': etag, 'Last-Modified': formatdate(stat.st_mtime, usegmt=True)})
+        else:
+            self.send_error(404)
+
+    def __send(self, status, body, headers):
+        """ Sends a response with the given status, body and headers. """
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, message_format, *args):
+        logging.debug(message_format % args)
+
+
+def serve(nexus_path, port=0):
+    """
+    Serves the repository in a background thread.
+    :param nexus_path: The directory of the repository.
+    :param port: The port to listen on, by default any free port.
+    :return: The server, whose 'server_port' is the port listened on, and whose 'requests' is the number of requests served.
+    """
+    server = ThreadingHTTPServer(('localhost', port), partial(FakeNexusHandler, directory=nexus_path))
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check(poms_path, concurrency=4, missing=1, broken=1):
+    """
+    Crawls a fake nexus of the given poms with download.py, and checks that the release pom of every artifact is downloaded,
+    that artifacts failing with 404 Not Found are skipped without stopping the crawl, that artifacts with a maven-metadata.xml
+    that is not xml are downloaded by listing their versions, that a sync without changes downloads no
+    poms, and that a sync after a new release downloads only that pom.
+    :param poms_path: The path of the poms.
+    :param concurrency: The number of concurrent crawl workers.
+    :param missing: The number of artifacts whose release pom is missing.
+    :param broken: The number of artifacts whose maven-metadata.xml is not xml.
+    :return: True if every check passed.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        nexus_path = os.path.join(work_dir, 'nexus')
+        output_dir = os.path.join(work_dir, 'releases')
+        artifacts = build_nexus(poms_path, nexus_path, missing=missing, broken=broken)
+        server = serve(nexus_path)
+        url = f'http://localhost:{server.server_port}/'
+        download = [sys.executable, 'download.py', '--url', url, '--output-dir', output_dir, '--concurrency', str(concurrency),
+                    '--manifest', os.path.join(work_dir, 'sync_manifest.json'), '--pom-manifest', '']
+        repository_dir = os.path.dirname(os.path.abspath(__file__))
+        passed = True
+
+        def run_download(*args):
+            result = subprocess.run(download + list(args), cwd=repository_dir, capture_output=True, text=True)
+            if result.returncode != 0:
+                logging.error(result.stderr)
+            return result.returncode == 0, result.stderr.count('Writing pom to')
+
+        def report(name, ok):
+            nonlocal passed
+            passed = passed and ok
+            logging.info(f'{name}: {"OK" if ok else "FAILED"}')
+
+        completed, _ = run_download()
+        release = max(VERSIONS, key=version_key)
+        downloaded = {artifact: __read(os.path.join(output_dir, artifact, 'pom.xml')) for artifact in artifacts}
+        report(f'Crawl of {len(artifacts)} artifacts, {missing} without a release pom and {broken} with a broken '
+               f'maven-metadata.xml', completed and downloaded == {
+            artifact: None if content is None else version_pom(content, release) for artifact, content in artifacts.items()})
+
+        completed, written = run_download('--sync')
+        report('Sync without changes', completed and written == 0)
+
+        artifact = list(artifacts)[missing + broken]
+        artifact_id = os.path.basename(artifact)
+        os.makedirs(os.path.join(nexus_path, artifact, '2.0'))
+        with open(os.path.join(nexus_path, artifact, '2.0', f'{artifact_id}-2.0.pom'), 'wb') as pom:
+            pom.write(version_pom(artifacts[artifact], '2.0'))
+        write_metadata(os.path.join(nexus_path, artifact), artifact_id, VERSIONS + ['2.0'])
+        completed, written = run_download('--sync')
+        report('Sync after a new release', completed and written == 1 and
+               __read(os.path.join(output_dir, artifact, 'pom.xml')) == version_pom(artifacts[artifact], '2.0'))
+        logging.info(f'The fake nexus served {server.requests} requests.')
+        server.shutdown()
+        return passed
+
+
+def __read(path):
+    """ Returns the content of the file, or None if it does not exist. """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as read_file:
+        return read_file.read()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Serves a directory of poms as a fake nexus repository, to test download.py '
+                                                 'without the real nexus.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='Lays out the poms as a nexus repository and serves it until stopped.')
+    serve_parser.add_argument('--port', type=int, default=8081, help='The port to listen on, by default 8081.')
+    check_parser = commands.add_parser('check', help='Crawls and syncs a fake nexus of the poms with download.py, and checks '
+                                                     'what is downloaded.')
+    check_parser.add_argument('--concurrency', type=int, default=4,
+                              help='The number of concurrent crawl workers, by default 4.')
+    for command_parser in (serve_parser, check_parser):
+        command_parser.add_argument('path', help='The path of the poms, e.g. a corpus written by generate_corpus.py.')
+        command_parser.add_argument('--missing', type=int, default=1,
+                                    help='The number of artifacts whose release pom is missing, by default 1.')
+        command_parser.add_argument('--broken', type=int, default=1,
+                                    help='The number of artifacts whose maven-metadata.xml is not xml, by default 1.')
+    args = parser.parse_args()
+    if args.command == 'check':
+        sys.exit(0 if check(args.path, args.concurrency, args.missing, args.broken) else 1)
+    with tempfile.TemporaryDirectory() as nexus_dir:
+        build_nexus(args.path, nexus_dir, missing=args.missing, broken=args.broken)
+        nexus = serve(nexus_dir, args.port)
+        logging.info(f'Serving the poms of {args.path} as a nexus repository at http://localhost:{nexus.server_port}/, '
+                     f'e.g. python3 download.py --url http://localhost:{nexus.server_port}/')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            nexus.shutdown()
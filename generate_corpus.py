@@ -0,0 +1,127 @@
+import argparse
+import logging
+import os
+import random
+from collections import deque
+from pathlib import Path
+
+from run import config, ns
+
+POM_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="{namespace}">
+  <modelVersion>4.0.0</modelVersion>
+{parent}{group_id}  <artifactId>{artifact_id}</artifactId>
+{version}  <name>{artifact_id}</name>
+  <properties>
+{properties}  </properties>
+  <dependencyManagement>
+    <dependencies>
+{managed_dependencies}    </dependencies>
+  </dependencyManagement>
+  <dependencies>
+{dependencies}  </dependencies>
+</project>
+'''
+
+
+def generate_corpus(path, poms=1000, depth=4, fan_out=4, alt_group_ratio=0.2, property_ratio=0.5, seed=0):
+    """
+    Writes a synthetic releases/-style tree of poms, i.e. path/group/id/artifact-id/pom.xml, for benchmarking.
+
+    The poms are split into packages, each with a parent pom and a hierarchy of child poms that is at most depth levels deep,
+    where every pom has at most fan_out children. Some children get their own groupId, which is then used as alternative name by
+    their own children. Some dependency versions are given using properties, possibly defined by another property or in a parent.
+    :param path: The directory to write the poms to.
+    :param poms: The number of poms.
+    :param depth: The depth of the hierarchy of every package.
+    :param fan_out: The number of children of every pom.
+    :param alt_group_ratio: The ratio of child poms with their own groupId.
+    :param property_ratio: The ratio of dependency versions defined using a property.
+    :param seed: The seed for the random generator, the same arguments and seed always give the same corpus.
+    :return: The number of poms written.
+    """
+    rng = random.Random(seed)
+    package_size = sum(fan_out ** level for level in range(depth + 1))
+    artifacts = []
+    written = 0
+    package = 0
+    while written < poms:
+        group_id = f'org.example.package{package}'
+        # (artifact ID, groupId of the pom, (groupId, artifact ID) of the parent, level)
+        queue = deque([(f'package{package}-parent', group_id, None, 0)])
+        while queue and written < poms:
+            artifact_id, pom_group_id, parent, level = queue.popleft()
+            # A child only has its own <groupId> if it differs from the groupId of its parent.
+            own_group_id = pom_group_id if level == 0 or pom_group_id != parent[0] else None
+            __write_pom(path, rng, artifact_id, pom_group_id, own_group_id, parent, level, artifacts, property_ratio)
+            artifacts.append(artifact_id)
+            written += 1
+            if level < depth:
+                for child in range(fan_out):
+                    child_id = f'{artifact_id}-{child}' if level else f'package{package}-module{child}'
+                    child_group_id = f'{pom_group_id}.sub{child}' if rng.random() < alt_group_ratio else pom_group_id
+                    queue.append((child_id, child_group_id, (pom_group_id, artifact_id), level + 1))
+        package += 1
+    logging.info(f'Generated {written} poms in {package} packages of at most {package_size} poms.')
+    return written
+
+
+def __write_pom(path, rng, artifact_id, pom_group_id, own_group_id, parent, level, artifacts, property_ratio):
+    """ Writes a single pom of the corpus. """
+    namespace = ns['pom']
+    properties, managed_dependencies, dependencies = [], [], []
+    if level == 0:
+        parent_tag = '  <parent>\n    <groupId>org.sbforge</groupId>\n    <artifactId>sbforge-parent</artifactId>\n' \
+                     '    <version>22</version>\n  </parent>\n'
+        for k in range(10):
+            properties.append(f'    <library{k}.version>{rng.randint(1, 5)}.{rng.randint(0, 20)}</library{k}.version>\n')
+            managed_dependencies.append(__dependency(f'library{k}', f'${{library{k}.version}}', 6))
+        properties.append('    <indirect.version>${library0.version}</indirect.version>\n')
+    else:
+        parent_tag = f'  <parent>\n    <groupId>{parent[0]}</groupId>\n    <artifactId>{parent[1]}</artifactId>\n' \
+                     f'    <version>1.0</version>\n  </parent>\n'
+        properties.append(f'    <{artifact_id}.version>{level}.{rng.randint(0, 9)}</{artifact_id}.version>\n')
+
+    for _ in range(rng.randint(2, 8)):
+        if artifacts and rng.random() < 0.3:
+            # Dependency on another module of the corpus.
+            dependencies.append(__dependency(rng.choice(artifacts), '${project.version}', 4))
+        elif rng.random() < property_ratio:
+            version = rng.choice(['${library%d.version}' % rng.randrange(10), '${indirect.version}',
+                                  '${%s.version}' % artifact_id if level else '${project.version}'])
+            dependencies.append(__dependency(f'library{rng.randrange(10)}', version, 4))
+        else:
+            dependencies.append(__dependency(f'external{rng.randrange(100)}', f'{rng.randint(1, 3)}.{rng.randint(0, 9)}', 4))
+
+    pom = POM_TEMPLATE.format(namespace=namespace, parent=parent_tag,
+                              group_id=f'  <groupId>{own_group_id}</groupId>\n' if own_group_id else '',
+                              artifact_id=artifact_id, version='  <version>1.0</version>\n' if level % 2 == 0 else '',
+                              properties=''.join(properties), managed_dependencies=''.join(managed_dependencies),
+                              dependencies=''.join(dependencies))
+    pom_dir = os.path.join(path, *pom_group_id.split('.'), artifact_id)
+    Path(pom_dir).mkdir(parents=True, exist_ok=True)
+    with open(os.path.join(pom_dir, 'pom.xml'), 'w') as pom_file:
+        pom_file.write(pom)
+
+
+def __dependency(artifact_id, version, indent):
+    """ Returns a <dependency> tag with the given indentation. """
+    space = ' ' * indent
+    return f'{space}<dependency>\n{space}  <groupId>org.example</groupId>\n{space}  <artifactId>{artifact_id}</artifactId>\n' \
+           f'{space}  <version>{version}</version>\n{space}</dependency>\n'
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=config.get("all", "logging_level").upper())
+    parser = argparse.ArgumentParser(description='Generates a synthetic releases/-style tree of poms for benchmarking.')
+    parser.add_argument('path', help='The directory to write the poms to.')
+    parser.add_argument('--poms', type=int, default=1000, help='The number of poms, by default 1000.')
+    parser.add_argument('--depth', type=int, default=4, help='The depth of the hierarchy of every package, by default 4.')
+    parser.add_argument('--fan-out', type=int, default=4, help='The number of children of every pom, by default 4.')
+    parser.add_argument('--alt-group-ratio', type=float, default=0.2,
+                        help='The ratio of child poms with their own groupId, by default 0.2.')
+    parser.add_argument('--property-ratio', type=float, default=0.5,
+                        help='The ratio of dependency versions defined using a property, by default 0.5.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed for the random generator, by default 0.')
+    args = parser.parse_args()
+    generate_corpus(args.path, args.poms, args.depth, args.fan_out, args.alt_group_ratio, args.property_ratio, args.seed)
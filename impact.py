@@ -0,0 +1,154 @@
+import json
+import logging
+import re
+
+from metrics import metrics
+
+nonzero_byte_pattern = re.compile(b'[^\x00]')
+
+
+def build_graph(obj):
+    """
+    Builds a compact graph of the modules in the structure, where every module name has an integer id, given in alphabetical
+    order. A module has an edge to every dependency that is a module in the structure, and to its parent module, since it
+    inherits from it.
+    :param obj: The structure dictionary.
+    :return: The module names indexed by id, the packages of every module name, and the ids every module has edges to.
+    """
+    packages, modules = {}, []
+    for key, val in sorted(obj.items()):
+        stack = [(module, None) for module in reversed(val['modules'])]
+        while stack:
+            module, parent = stack.pop()
+            module_packages = packages.setdefault(module.name, [])
+            if key not in module_packages:
+                module_packages.append(key)
+            modules.append((module, parent))
+            stack.extend((child, module) for child in reversed(module.modules))
+
+    names = sorted(packages)
+    ids = {name: i for i, name in enumerate(names)}
+    adjacency = [set() for _ in names]
+    for module, parent in modules:
+        edges = adjacency[ids[module.name]]
+        edges.update(ids[dependency] for dependency in module.dependency_names() if dependency in ids)
+        if parent is not None:
+            edges.add(ids[parent.name])
+    return names, [packages[name] for name in names], [sorted(edges) for edges in adjacency]
+
+
+def strongly_connected_components(adjacency):
+    """
+    Finds the strongly connected components of the graph using an iterative version of Tarjan's algorithm.
+    :param adjacency: The ids every node has edges to.
+    :return: The components as lists of ids, in reverse topological order: a component comes after every component it reaches.
+    """
+    index, low, on_stack, stack, components = [None] * len(adjacency), [0] * len(adjacency), [False] * len(adjacency), [], []
+    counter = 0
+    for start in range(len(adjacency)):
+        if index[start] is not None:
+            continue
+        # (node, position of the next edge to follow)
+        work = [(start, 0)]
+        while work:
+            node, position = work.pop()
+            if position == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            for i in range(position, len(adjacency[node])):
+                successor = adjacency[node][i]
+                if index[successor] is None:
+                    work.append((node, i + 1))
+                    work.append((successor, 0))
+                    break
+                if on_stack[successor]:
+                    low[node] = min(low[node], index[successor])
+            else:
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+    return components
+
+
+def transitive_closures(adjacency):
+    """
+    Computes the transitive closure and reverse closure of every node in one batch. Every closure is a bitset row stored in an
+    int, where bit i is set if node i is reached, so the rows of the strongly connected components can be combined with a single
+    OR each, in topological order.
+    :param adjacency: The ids every node has edges to.
+    :return: For every node, the bitset of the nodes it reaches, and the bitset of the nodes reaching it. A node only reaches
+    itself if it is part of a cycle.
+    """
+    components = strongly_connected_components(adjacency)
+    component_of = [0] * len(adjacency)
+    for c, component in enumerate(components):
+        for node in component:
+            component_of[node] = c
+
+    successors, members = [set() for _ in components], [0] * len(components)
+    for c, component in enumerate(components):
+        for node in component:
+            members[c] |= 1 << node
+            successors[c].update(component_of[successor] for successor in adjacency[node])
+    predecessors = [set() for _ in components]
+    for c, successor_components in enumerate(successors):
+        for successor in successor_components:
+            predecessors[successor].add(c)
+
+    # Components reached by a component come before it, and components reaching it come after it.
+    reach = [0] * len(components)
+    for c in range(len(components)):
+        for successor in successors[c]:
+            reach[c] |= (members[successor] if successor != c else 0) | reach[successor]
+    reached_by = [0] * len(components)
+    for c in reversed(range(len(components))):
+        for predecessor in predecessors[c]:
+            reached_by[c] |= (members[predecessor] if predecessor != c else 0) | reached_by[predecessor]
+    for c, component in enumerate(components):
+        if len(component) > 1 or c in successors[c]:
+            reach[c] |= members[c]
+            reached_by[c] |= members[c]
+
+    return [reach[component_of[node]] for node in range(len(adjacency))], \
+        [reached_by[component_of[node]] for node in range(len(adjacency))]
+
+
+def write_impact_report(obj, path='affected_modules.json'):
+    """
+    Writes the 'affected modules' report to a .json file. For every module in the structure it lists the modules it depends on
+    transitively, and the modules affected by a change to it, i.e. the modules depending on it transitively.
+    :param obj: The structure dictionary, with the dependency versions fixed.
+    :param path: The path of the report.
+    """
+    names, packages, adjacency = build_graph(obj)
+    reach, reached_by = transitive_closures(adjacency)
+    with open(path, 'w') as output:
+        output.write('{')
+        for node, name in enumerate(names):
+            entry = {'packages': packages[node], 'depends_on': __names(reach[node], names),
+                     'affects': __names(reached_by[node], names)}
+            output.write((', ' if node else '') + json.dumps({name: entry})[1:-1])
+        output.write('}')
+    metrics.count_file(path)
+    logging.info(f'Impact report for {len(names)} modules written to .json file.')
+
+
+def __names(bits, names):
+    """ Returns the names of the nodes set in the bitset, in the order of their ids. Only the non-zero bytes of the bitset are
+    looked at, so this is fast for sparse rows. """
+    result = []
+    for match in nonzero_byte_pattern.finditer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        byte, offset = match.group()[0], match.start() * 8
+        result.extend(names[offset + bit] for bit in range(8) if byte >> bit & 1)
+    return result
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory use is left out of the summary.
+    resource = None
+
+
+class Metrics:
+    """
+    Wall time per phase and counters of a run, e.g. the number of poms parsed or module lookups done. The modules used by run.py
+    all count into the shared 'metrics' instance below, which run.py resets at the start of every run.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = Counter()
+
+    def reset(self):
+        """ Forgets the phases and counters of the previous run. """
+        self.phases.clear()
+        self.counters.clear()
+
+    @contextmanager
+    def phase(self, name):
+        """ Context manager adding the wall time spent inside it to the given phase. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        """ Adds the amount to the given counter. """
+        self.counters[name] += amount
+
+    def count_file(self, path):
+        """ Adds the size of the written file to the 'bytes_written' counter. """
+        self.counters['bytes_written'] += os.path.getsize(path)
+
+    def summary(self):
+        """ Returns the phases, in seconds, the counters and the peak memory use of the process as a dictionary. """
+        summary = {'seconds': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+                   'total_seconds': round(sum(self.phases.values()), 4), 'counters': dict(sorted(self.counters.items()))}
+        if resource is not None:
+            # Kilobytes on Linux, bytes on macOS.
+            summary['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return summary
+
+    def write_summary(self, path):
+        """ Writes the summary to a .json file, and logs it on a single line. """
+        summary = self.summary()
+        with open(path, 'w') as output:
+            json.dump(summary, output, indent=2)
+        logging.info(f'Run summary: {json.dumps(summary)}')
+
+
+metrics = Metrics()
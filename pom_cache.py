@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import sqlite3
+
+from metrics import metrics
+from pom_record import PomRecord, intern_record
+
+# Increase when the content of a PomRecord changes, so records extracted by an older version are not used.
+CACHE_VERSION = 1
+
+
+class PomCache:
+    """
+    On-disk SQLite cache of the PomRecords extracted from the poms, keyed by the path of the pom. A cached record is only used if
+    the mtime and size of the pom are the same as when it was extracted.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != CACHE_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS poms')
+            self.connection.execute(f'PRAGMA user_version = {CACHE_VERSION}')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS poms (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, record TEXT)')
+        self.hits, self.misses, self.removed = 0, 0, 0
+
+    def read_poms(self, pom_paths, read_records, stats=None):
+        """
+        Returns the records of the given poms, taking the unchanged ones from the cache and extracting the new or changed ones
+        using read_records. Records of poms that are no longer found are removed from the cache.
+        :param pom_paths: The paths of all the poms.
+        :param read_records: A function extracting a list of PomRecords from a list of paths.
+        :param stats: The current (mtime_ns, size) of every pom, if already known, e.g. from a walk of the directory in this run.
+        By default every pom is stat'ed.
+        :return: A list of PomRecords, in the same order as the paths.
+        """
+        cached = {path: (mtime_ns, size, record) for path, mtime_ns, size, record in
+                  self.connection.execute('SELECT path, mtime_ns, size, record FROM poms')}
+        records, changed = {}, []
+        if stats is None:
+            stats = [(stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, pom_paths)]
+        for path, stat in zip(pom_paths, stats):
+            entry = cached.pop(path, None)
+            if entry is not None and entry[:2] == stat:
+                records[path] = self.__to_record(path, entry[2])
+            else:
+                changed.append((path, stat))
+
+        with self.connection:
+            if changed:
+                for (path, stat), record in zip(changed, read_records([path for path, _ in changed])):
+                    records[path] = record
+                    self.connection.execute('INSERT OR REPLACE INTO poms VALUES (?, ?, ?, ?)',
+                                            (path, *stat, json.dumps(record[1:])))
+            # Whatever is left in the cache was not found this time.
+            self.connection.executemany('DELETE FROM poms WHERE path = ?', [(path,) for path in cached])
+
+        self.hits += len(pom_paths) - len(changed)
+        self.misses += len(changed)
+        self.removed += len(cached)
+        metrics.count('pom_cache_hits', len(pom_paths) - len(changed))
+        logging.info(f'Pom cache: {self.hits} hits, {self.misses} misses, {self.removed} removed.')
+        return [records[path] for path in pom_paths]
+
+    def close(self):
+        """ Closes the connection to the cache. """
+        self.connection.close()
+
+    @staticmethod
+    def __to_record(path, values):
+        """ Creates a PomRecord from the path and the JSON values stored in the cache. """
+        return intern_record(PomRecord(path, *json.loads(values)))
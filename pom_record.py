@@ -0,0 +1,77 @@
+import sys
+from collections import namedtuple
+
+from lxml import etree
+
+PomRecord = namedtuple('PomRecord', ['path', 'group_id', 'artifact_id', 'version', 'parent_group_id', 'parent_artifact_id',
+                                     'parent_version', 'properties', 'dependencies'])
+PomRecord.__doc__ = """
+Immutable record holding everything the parent and child passes need from a single pom.xml.
+
+group_id, artifact_id, parent_group_id and parent_artifact_id are lower-cased, as they are used as keys in the structure. The
+remaining values are kept as found in the pom. 'properties' is a tuple of (tag, text) pairs from the <properties> tag and
+'dependencies' is a tuple of (artifactId, version) pairs, where the version is 'inherited' if the dependency has none. Every
+string but the path is interned.
+"""
+
+
+def read_pom_record(path, ns):
+    """
+    Parses the pom.xml at the given path and extracts the information used to build the structure.
+
+    The coordinates, <parent> and <properties> are read in one walk over the top-level elements of the pom. The dependencies are
+    read from every <dependencies> tag in the pom, including <dependencyManagement> and plugins, in a single iteration over the
+    <dependency> elements.
+    :param path: The path of the pom.xml file, or a file object with the content of the pom.
+    :param ns: The namespace dictionary, as defined in the config file.
+    :return: A PomRecord for the pom.
+    """
+    pom = '{' + ns['pom'] + '}'
+    root = etree.parse(path).getroot()
+    project, parent, properties, dependencies = {}, {}, [], []
+
+    for element in root.iterchildren(tag=etree.Element):
+        project.setdefault(element.tag, element.text)
+        if element.tag == pom + 'parent':
+            for child in element.iterchildren(tag=etree.Element):
+                parent.setdefault(child.tag, child.text)
+        elif element.tag == pom + 'properties':
+            for child in element.iterchildren(tag=etree.Element):
+                properties.append((intern(etree.QName(child).localname), intern(child.text)))
+
+    for dependency in root.iter(pom + 'dependency'):
+        if dependency.getparent().tag != pom + 'dependencies':
+            continue
+        artifact_id = version = None
+        for child in dependency.iterchildren(pom + 'artifactId', pom + 'version'):
+            if child.tag == pom + 'artifactId':
+                artifact_id = child if artifact_id is None else artifact_id
+            else:
+                version = child if version is None else version
+        dependencies.append((intern(artifact_id.text), 'inherited' if version is None else intern(version.text)))
+
+    return PomRecord(path, __lower(project.get(pom + 'groupId')), sys.intern(project[pom + 'artifactId'].lower()),
+                     intern(project.get(pom + 'version')), __lower(parent.get(pom + 'groupId')),
+                     __lower(parent.get(pom + 'artifactId')), intern(parent.get(pom + 'version')), tuple(properties),
+                     tuple(dependencies))
+
+
+def intern_record(record):
+    """
+    Returns the record with its strings interned, for records that were not created by read_pom_record in this process, e.g.
+    records from the pom cache or from other processes.
+    """
+    return PomRecord(record.path, *(intern(value) for value in record[1:7]),
+                     tuple((intern(tag), intern(text)) for tag, text in record.properties),
+                     tuple((intern(name), intern(version)) for name, version in record.dependencies))
+
+
+def intern(text):
+    """ Returns the interned text, or None if there is no text. The same ids and versions are found in many poms, so they are
+    only stored once. """
+    return sys.intern(text) if text is not None else None
+
+
+def __lower(text):
+    """ Returns the interned text in lower case, or None if there is no text. """
+    return sys.intern(text.lower()) if text is not None else None
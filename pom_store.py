@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+from utility import version_key
+
+# An entry of the offset index: the sha256 of the pom, and the offset and length of its compressed content in the pack file.
+index_entry = struct.Struct('<32sQI')
+
+
+class PomStore:
+    """
+    Content-addressed store of every version of the poms. The content of each distinct pom is stored once, compressed, in the
+    append-only pack file 'poms.pack', which is memory-mapped when read. The offset index 'poms.idx' has a fixed-size entry per
+    pom, giving the offset of its content by its sha256. The version index 'versions.sqlite' maps every version of an artifact
+    to the sha256 of its pom, and to the time it was released.
+    """
+
+    def __init__(self, path):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.pack = open(os.path.join(path, 'poms.pack'), 'a+b')
+        self.index = open(os.path.join(path, 'poms.idx'), 'a+b')
+        self.connection = sqlite3.connect(os.path.join(path, 'versions.sqlite'), check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS versions (artifact TEXT, version TEXT, hash BLOB, released REAL, '
+                                'PRIMARY KEY (artifact, version))')
+        self.lock = threading.Lock()
+        self.offsets = self.__read_index()
+        self.mapped = None
+
+    def add_version(self, artifact, version, content, released=None):
+        """
+        Stores the pom of a version of an artifact. The content is only added to the pack file if no other pom has the same
+        content.
+        :param artifact: The artifact, as the path of its directory relative to the directory the poms are downloaded to.
+        :param version: The version.
+        :param content: The bytes of the pom.
+        :param released: The time the version was released as a POSIX timestamp, by default now.
+        """
+        digest = hashlib.sha256(content).digest()
+        with self.lock:
+            if digest not in self.offsets:
+                compressed = zlib.compress(content)
+                self.pack.seek(0, os.SEEK_END)
+                offset = self.pack.tell()
+                self.pack.write(compressed)
+                self.pack.flush()
+                # The index entry is written after the content, so the index never points past the end of the pack file.
+                self.index.write(index_entry.pack(digest, offset, len(compressed)))
+                self.index.flush()
+                self.offsets[digest] = (offset, len(compressed))
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)',
+                                        (artifact, version, digest, datetime.now(timezone.utc).timestamp()
+                                         if released is None else released))
+
+    def versions(self, artifact):
+        """ Returns the versions of the artifact in the store. """
+        with self.lock:
+            return {version for version, in self.connection.execute('SELECT version FROM versions WHERE artifact = ?',
+                                                                    (artifact,))}
+
+    def read(self, digest):
+        """ Returns the content of the pom with the given sha256. """
+        offset, length = self.offsets[digest]
+        if self.mapped is None or offset + length > len(self.mapped):
+            # The pack file has grown since it was mapped.
+            if self.mapped is not None:
+                self.mapped.close()
+            self.mapped = mmap.mmap(self.pack.fileno(), 0, access=mmap.ACCESS_READ)
+        return zlib.decompress(self.mapped[offset:offset + length])
+
+    def snapshot(self, released_before=None):
+        """
+        Returns the version of every artifact in a snapshot of the store, which is the newest version of every artifact, or the
+        newest version released before the given time.
+        :param released_before: A POSIX timestamp, None for the newest versions.
+        :return: A list of (artifact, version, sha256), sorted by artifact.
+        """
+        query = 'SELECT artifact, version, hash FROM versions'
+        with self.lock:
+            if released_before is None:
+                rows = self.connection.execute(query).fetchall()
+            else:
+                rows = self.connection.execute(query + ' WHERE released < ?', (released_before,)).fetchall()
+        newest = {}
+        for artifact, version, digest in rows:
+            if artifact not in newest or version_key(version) > version_key(newest[artifact][0]):
+                newest[artifact] = (version, digest)
+        return [(artifact, version, digest) for artifact, (version, digest) in sorted(newest.items())]
+
+    def close(self):
+        """ Closes the files of the store, and logs its size. """
+        logging.info(f'Pom store: {self.connection.execute("SELECT COUNT(*) FROM versions").fetchone()[0]} versions, '
+                     f'{len(self.offsets)} distinct poms, {os.path.getsize(self.pack.name)} bytes.')
+        if self.mapped is not None:
+            self.mapped.close()
+        self.pack.close()
+        self.index.close()
+        self.connection.close()
+
+    def __read_index(self):
+        """ Reads the offset index. An entry left incomplete by an interrupted write is removed. """
+        offsets = {}
+        size = os.path.getsize(self.index.name)
+        if size % index_entry.size:
+            size -= size % index_entry.size
+            self.index.truncate(size)
+        if size == 0:
+            return offsets
+        with mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for digest, offset, length in index_entry.iter_unpack(mapped[:size]):
+                offsets[digest] = (offset, length)
+        return offsets
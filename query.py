@@ -0,0 +1,89 @@
+import argparse
+import json
+import re
+
+from utility import version_key
+
+# A single Maven version range, e.g. '[1.0,2.0)', '[1.5,)' or '[1.2]'.
+range_pattern = re.compile(r'([\[(])([^\[\]()]*)([\])])')
+
+
+def load_index(path='dependency_index.json'):
+    """ Loads the dependency index written by run.py. """
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+def find_dependents(index, artifact, version_range=None):
+    """
+    Finds the modules depending on the artifact.
+    :param index: The dependency index.
+    :param artifact: The artifact ID of the dependency.
+    :param version_range: A Maven version range, e.g. '[1.0,2.0)'. If given, only dependents using a version in the range are
+    returned.
+    :return: A list of the package, module, version and dependency version of each dependent.
+    """
+    dependents = index['dependents'].get(artifact, [])
+    if version_range is None:
+        return dependents
+    in_range = parse_version_range(version_range)
+    return [dependent for dependent in dependents if in_range(dependent['dependency_version'])]
+
+
+def find_module(index, module):
+    """
+    Finds the module and the modules depending on it.
+    :param index: The dependency index.
+    :param module: The artifact ID of the module.
+    :return: A dictionary with the 'modules' found with the name, and their 'dependents'.
+    """
+    return {'modules': index['modules'].get(module, []), 'dependents': index['dependents'].get(module, [])}
+
+
+def parse_version_range(version_range):
+    """
+    Parses a Maven version range into a function telling whether a version is within the range. Several ranges can be given
+    separated by commas, e.g. '(,1.0],[1.2,)', and a version without brackets only matches that exact version. Versions that are
+    not resolved, e.g. '${project.version}' or 'inherited', are never within a range.
+    :param version_range: The version range.
+    :return: A function taking a version and returning True if it is within the range.
+    """
+    ranges = []
+    for lower_bracket, bounds, upper_bracket in range_pattern.findall(version_range):
+        lower, _, upper = bounds.partition(',') if ',' in bounds else (bounds, None, bounds)
+        ranges.append((version_key(lower) if lower.strip() else None, lower_bracket == '[',
+                       version_key(upper) if upper.strip() else None, upper_bracket == ']'))
+    if not ranges:
+        ranges.append((version_key(version_range), True, version_key(version_range), True))
+
+    def in_range(version):
+        if not version or '${' in version or version == 'inherited':
+            return False
+        key = version_key(version)
+        for lower, lower_inclusive, upper, upper_inclusive in ranges:
+            if lower is not None and (key < lower or key == lower and not lower_inclusive):
+                continue
+            if upper is not None and (key > upper or key == upper and not upper_inclusive):
+                continue
+            return True
+        return False
+    return in_range
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Queries the dependency index written by run.py, without rebuilding the structure.')
+    parser.add_argument('--index', default='dependency_index.json', help='The dependency index, by default dependency_index.json.')
+    subparsers = parser.add_subparsers(dest='query', required=True)
+    artifact_parser = subparsers.add_parser('artifact', help='Finds the modules depending on an artifact.')
+    artifact_parser.add_argument('artifact', help='The artifact ID of the dependency.')
+    artifact_parser.add_argument('--range', help='Only modules using a version in this Maven version range, e.g. \'[1.0,2.0)\'.')
+    module_parser = subparsers.add_parser('module', help='Finds a module and the modules depending on it.')
+    module_parser.add_argument('module', help='The artifact ID of the module.')
+    args = parser.parse_args()
+
+    dependency_index = load_index(args.index)
+    if args.query == 'artifact':
+        result = find_dependents(dependency_index, args.artifact, args.range)
+    else:
+        result = find_module(dependency_index, args.module)
+    print(json.dumps(result, indent=2))
@@ -1,20 +1,33 @@
+import argparse
+import cProfile
 import logging
-import os
 import sys
 from configparser import ConfigParser
+from datetime import datetime, timezone
+from functools import partial
+from io import BytesIO
+from multiprocessing import Pool
 
-from assign_children import __find_children
+from assign_children import __assign_children
 from assign_parents import __find_parents
+from discovery import PomManifest, walk_poms
+from impact import write_impact_report
+from metrics import metrics
+from pom_cache import PomCache
+from pom_record import intern_record, read_pom_record
+from pom_store import PomStore
 from structure import Structure
 from utility import fix_dependency_versions
 
 config = ConfigParser()
 config.read("config.conf")
-number_of_runs = int(config.get("worker", "find_children_runs"))
 ns = {'pom': config.get("all", "namespace_url")}
-
-struct = Structure(number_of_runs, ns)
-obj, number_of_runs = struct.obj, struct.number_of_runs,
+parse_processes = config.getint("worker", "parse_processes")
+pom_cache_path = config.get("worker", "pom_cache")
+pom_manifest_path = config.get("worker", "pom_manifest")
+discovery_threads = config.getint("worker", "discovery_threads")
+run_summary_path = config.get("worker", "run_summary")
+pom_store_path = config.get("pom_store", "path")
 
 
 def setup_logging():
@@ -24,75 +37,259 @@ def setup_logging():
         level=config.get("all", "logging_level").upper())
 
 
-def run(file_type, path='releases/'):
+def run(file_type, path='releases/', processes=1, cache_path=None, impact=False, summary_path=None, snapshot=None,
+        store_path=pom_store_path, manifest_path=None, rescan=False, threads=1):
     """
     Main method for running the dictionary creation.
 
-    Runs through all the poms and converting every parent pom to a dictionary structure.
-    Runs through the pom again a number of times equal to a variable defined in the configs file. In these runs, it will assign
-    children poms to their respective parents. The reason this needs to run > 1 times, is that we cannot guarantee that a pom which
-    would be a child of the outer parent is created before we look at the pom that is the grandchild.
+    Parses every pom once into a PomRecord, and runs through the records converting every parent pom to a dictionary structure.
+    Then assigns the children poms to their respective parents in a single pass, ordered so that every pom is assigned after its
+    own parent, no matter how deep the hierarchy is.
 
     :param file_type: Defines the output file-type
     :param path: Defines the path of the poms, by default uses the value 'releases/'.
+    :param processes: The number of processes used to parse the poms.
+    :param cache_path: The path of the pom cache, only new or changed poms are parsed if given.
+    :param impact: Also writes the report of the modules affected by a change to each module.
+    :param summary_path: The path of the .json file with the time spent in every phase and the counters of the run, if given.
+    :param snapshot: If given, the poms are read from a snapshot of the pom store instead of the path. Either 'newest' for the
+    newest version of every artifact, or an ISO date or time, e.g. '2021-06-01', for the newest versions released before it.
+    :param store_path: The path of the pom store.
+    :param manifest_path: The path of the pom manifest. If given, the poms are read from it instead of walking the path, and
+    the manifest is written when the path is walked.
+    :param rescan: Walks the path even if the pom manifest exists, and writes the manifest again.
+    :param threads: The number of threads walking the path.
+    :return: False if the snapshot has no poms, in which case no output is written, True otherwise.
     """
-    total_nr_of_poms = count_poms(path)
-    poms_left = total_nr_of_poms
+    metrics.reset()
+    if snapshot:
+        store = PomStore(store_path)
+        records = read_store_poms(store, None if snapshot == 'newest' else __parse_time(snapshot), processes)
+        store.close()
+        if not records:
+            logging.warning(f'The snapshot \'{snapshot}\' of the pom store {store_path} has no poms, e.g. no versions were '
+                            f'released before it, so the outputs are not written.')
+            return False
+    else:
+        manifest = PomManifest(manifest_path, path) if manifest_path else None
+        if manifest is not None and rescan:
+            # An empty manifest is never used, so the path is walked and the manifest written again.
+            manifest.replace([], [])
+        cache = PomCache(cache_path) if cache_path else None
+        records = read_poms(path, processes, cache, manifest, threads)
+        if cache is not None:
+            cache.close()
+    total_nr_of_poms = len(records)
 
-    # Assign parent poms
-    for root, dirs, files in os.walk(path):
-        if files and files[0] == 'pom.xml':
-            poms_left -= __find_parents(os.path.join(root, files[0]), struct)
-
-    # Assign children poms, run through a few times, since we can't assure correct order
-    for i in range(number_of_runs):
-        for root, dirs, files in os.walk(path):
-            if files and files[0] == 'pom.xml':
-                if i + 1 == number_of_runs:
-                    poms_left -= __find_children(os.path.join(root, files[0]), struct, True)
-                else:
-                    __find_children(os.path.join(root, files[0]), struct)
+    struct, poms_left = build_structure(records)
+    # The structure holds everything needed from here on, so the records can be freed before the output is created.
+    del records
+    metrics.count('poms_unassigned', poms_left)
 
     if poms_left > 0:
         logging.info(f'Could not assign {str(poms_left)} out of {str(total_nr_of_poms)} poms.')
     else:
         logging.info('All poms assigned.')
 
+    write_outputs(struct, file_type, impact)
+
+    if summary_path:
+        metrics.write_summary(summary_path)
+    return True
+
+
+def build_structure(records):
+    """
+    Builds the structure from the records, assigning the parent poms, then the children poms, and then fixing the versions of
+    the dependencies.
+    :param records: The PomRecords of the poms, in the order they were found.
+    :return: The structure, and the number of poms that could not be assigned.
+    """
+    struct = Structure()
+    poms_left = len(records)
+
+    # Assign parent poms
+    with metrics.phase('parent_pass'):
+        for record in records:
+            poms_left -= __find_parents(record, struct)
+
+    # Assign children poms
+    with metrics.phase('child_pass'):
+        poms_left -= __assign_children(records, struct)
+
     # Go through the dependencies to map the versions correctly to their <properties> assignments
-    fix_dependency_versions(obj, struct.dependency_map)
+    with metrics.phase('version_fixing'):
+        fix_dependency_versions(struct.obj, struct.dependency_map)
+    return struct, poms_left
+
+
+def write_outputs(struct, file_type, impact=False):
+    """
+    Writes the structure to the output files of the file-type, and the impact report if asked for.
+    :param struct: The structure, with the versions of the dependencies fixed. Its 'alt-name' keys are removed.
+    :param file_type: Defines the output file-type.
+    :param impact: Also writes the report of the modules affected by a change to each module.
+    """
+    if impact:
+        with metrics.phase('impact'):
+            write_impact_report(struct.obj)
 
     # Remove 'alt-name' since it is redundant information at this point
     struct.remove_alt_name()
 
     # Either output csv or json file, depending on the given output.
-    if file_type == 'csv':
-        struct.write_csv()
-    elif file_type == 'json':
-        struct.write_dependency_map_json()
-        struct.write_json()
-    else:
-        print('Argument \'' + file_type + '\' is not a valid file-type, use csv or json.')
+    with metrics.phase('output'):
+        if file_type == 'csv':
+            struct.write_csv()
+        elif file_type == 'json':
+            struct.write_dependency_map_json()
+            struct.write_dependency_index_json()
+            struct.write_json()
+        elif file_type == 'ndjson':
+            struct.write_ndjson()
+        elif file_type == 'sqlite':
+            struct.write_sqlite()
+        else:
+            print('Argument \'' + file_type + '\' is not a valid file-type, use csv, json, ndjson or sqlite.')
 
 
-def count_poms(path='releases/'):
+def find_poms(path='releases/', threads=1):
     """
-    Walks through the given path and count the number of pom.xml files found.
+    Walks through the given path and returns the path of every pom.xml file found, see discovery.walk_poms.
     :param path: The path to find poms in.
+    :param threads: The number of threads walking the top-level directories.
     """
-    counter = 0
-    for _, _, files in os.walk(path):
-        if files and files[0] == 'pom.xml':
-            counter += 1
-    return counter
+    return [pom_path for pom_path, _, _ in walk_poms_counted(path, threads)[0]]
+
+
+def walk_poms_counted(path='releases/', threads=1):
+    """
+    Returns the (path, size, mtime_ns) of every pom.xml file under the given path, and the (path, mtime_ns) of every directory
+    walked, counting the directories and poms.
+    """
+    poms, directories = walk_poms(path, threads)
+    metrics.count('directories_walked', len(directories))
+    metrics.count('poms_found', len(poms))
+    return poms, directories
+
+
+def discover_poms(path='releases/', threads=1, manifest=None):
+    """
+    Finds every pom.xml file under the given path, reading them from the pom manifest if it has them and no directory has changed
+    since, or walking the path and writing the manifest if not.
+    :param path: The path to find poms in.
+    :param threads: The number of threads walking the top-level directories.
+    :param manifest: The PomManifest of the path, None to always walk the path.
+    :return: A list of (path, size, mtime_ns) of every pom, with their current size and mtime.
+    """
+    poms = manifest.poms(path) if manifest is not None else None
+    if poms:
+        metrics.count('poms_found', len(poms))
+        logging.info(f'Read {len(poms)} poms from the pom manifest {manifest.path}, the directory is not walked.')
+        return poms
+    poms, directories = walk_poms_counted(path, threads)
+    if manifest is not None:
+        manifest.replace(poms, directories)
+        manifest.save()
+    return poms
+
+
+def read_poms(path='releases/', processes=1, cache=None, manifest=None, threads=1):
+    """
+    Parses every pom.xml file found under the given path into a PomRecord, so each pom is only parsed once per run.
+    If a cache is given, only the poms that are new or changed since they were cached are parsed.
+    :param path: The path to find poms in.
+    :param processes: The number of processes used to parse the poms.
+    :param cache: The PomCache to read unchanged records from.
+    :param manifest: The PomManifest to read the poms from instead of walking the path, see discover_poms.
+    :param threads: The number of threads walking the path.
+    :return: A list of PomRecords, in the order the poms were found regardless of the number of processes.
+    """
+    with metrics.phase('discovery'):
+        poms = discover_poms(path, threads, manifest)
+        pom_paths = [pom_path for pom_path, _, _ in poms]
+    with metrics.phase('parsing'):
+        if cache is not None:
+            return cache.read_poms(pom_paths, partial(parse_poms, processes=processes),
+                                   [(mtime_ns, size) for _, size, mtime_ns in poms])
+        return parse_poms(pom_paths, processes)
+
+
+def read_store_poms(store, released_before=None, processes=1):
+    """
+    Parses the poms of a snapshot of the pom store into PomRecords. The path of each record is the artifact and version, e.g.
+    'org/example/artifact-id/1.0'.
+    :param store: The PomStore.
+    :param released_before: A POSIX timestamp, only versions released before it are used. None for the newest versions.
+    :param processes: The number of processes used to parse the poms.
+    :return: A list of PomRecords, sorted by artifact.
+    """
+    with metrics.phase('discovery'):
+        snapshot = store.snapshot(released_before)
+        metrics.count('poms_found', len(snapshot))
+    with metrics.phase('parsing'):
+        records = parse_poms([BytesIO(store.read(digest)) for _, _, digest in snapshot], processes)
+    return [record._replace(path=f'{artifact}/{version}') for record, (artifact, version, _) in zip(records, snapshot)]
+
+
+def __parse_time(text):
+    """ Returns the POSIX timestamp of an ISO date or time, which is in UTC unless a time zone is given. """
+    time = datetime.fromisoformat(text)
+    return (time if time.tzinfo is not None else time.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def parse_poms(pom_paths, processes=1):
+    """
+    Parses the given poms into PomRecords. If more than one process is given, the poms are parsed in a process pool and only
+    the records are sent back.
+    :param pom_paths: The paths of the poms to parse, or file objects with their content.
+    :param processes: The number of processes used to parse the poms.
+    :return: A list of PomRecords, in the same order as the paths.
+    """
+    metrics.count('poms_parsed', len(pom_paths))
+    if processes > 1 and len(pom_paths) > 1:
+        with Pool(processes) as pool:
+            chunksize = max(1, len(pom_paths) // (processes * 4))
+            return [intern_record(record) for record in pool.map(partial(read_pom_record, ns=ns), pom_paths, chunksize)]
+    return [read_pom_record(pom_path, ns) for pom_path in pom_paths]
 
 
 if __name__ == '__main__':
     setup_logging()
-    if len(sys.argv) < 2:
-        print('Need file-type as argument. Specific path as 2nd argument is optional.')
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Creates the dependency structure of the downloaded poms.')
+    parser.add_argument('file_type', help='The output file-type, either csv, json, ndjson or sqlite.')
+    parser.add_argument('path', nargs='?', default='releases/', help='The path of the poms, by default \'releases/\'.')
+    parser.add_argument('--processes', type=int, default=parse_processes,
+                        help='The number of processes used to parse the poms, by default [worker] parse_processes.')
+    parser.add_argument('--cache', default=pom_cache_path,
+                        help='The cache of parsed poms, by default [worker] pom_cache. Use an empty string to parse all poms.')
+    parser.add_argument('--impact', action='store_true',
+                        help='Also write affected_modules.json, with the transitive dependencies and dependents of every module.')
+    parser.add_argument('--summary', default=run_summary_path,
+                        help='The .json file with the time of every phase and the counters of the run, by default [worker] '
+                             'run_summary. Use an empty string to not write it.')
+    parser.add_argument('--profile', nargs='?', const='run.prof',
+                        help='Runs under cProfile and dumps the stats to the given file, by default \'run.prof\'. Poms parsed by '
+                             'other processes are not included.')
+    parser.add_argument('--snapshot',
+                        help='Read the poms from the pom store instead: \'newest\' for the newest version of every artifact, or an '
+                             'ISO date or time, e.g. \'2021-06-01\', for the newest versions released before it.')
+    parser.add_argument('--store', default=pom_store_path, help='The pom store, by default [pom_store] path.')
+    parser.add_argument('--manifest', default=pom_manifest_path,
+                        help='The manifest of the poms, by default [worker] pom_manifest. If it exists, the poms are read from it '
+                             'instead of walking the path. Use an empty string to always walk the path.')
+    parser.add_argument('--rescan', action='store_true', help='Walk the path even if the manifest exists, and write it again.')
+    parser.add_argument('--threads', type=int, default=discovery_threads,
+                        help='The number of threads walking the path, by default [worker] discovery_threads.')
+    args = parser.parse_args()
+    run_args = (args.file_type, args.path, args.processes, args.cache, args.impact, args.summary, args.snapshot, args.store,
+                args.manifest, args.rescan, args.threads)
+    if args.profile:
+        profiler = cProfile.Profile()
+        completed = profiler.runcall(run, *run_args)
+        profiler.dump_stats(args.profile)
+        logging.info(f'Profile written to {args.profile}, e.g. view it with: python3 -m pstats {args.profile}')
     else:
-        if len(sys.argv) > 2:
-            run(sys.argv[1], sys.argv[2])
-        else:
-            run(sys.argv[1])
+        completed = run(*run_args)
+    if not completed:
+        sys.exit(1)
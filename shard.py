@@ -0,0 +1,206 @@
+import argparse
+import json
+import logging
+import os
+import zlib
+from pathlib import Path
+
+from components import group_by_keys, merge_components, rank_packages, record_keys
+from metrics import metrics
+from pom_record import PomRecord, intern_record
+from run import build_structure, config, discovery_threads, find_poms, parse_poms, parse_processes, setup_logging, write_outputs
+from structure import Module, Structure, ignored_parents
+
+shard_output_dir = config.get("shard", "output_dir")
+group_depth = config.getint("shard", "group_depth")
+
+
+def find_partitions(path='releases/', depth=group_depth):
+    """
+    Walks the top levels of the given path and yields its partitions in the order os.walk finds them. A partition is a directory
+    at the given depth with all the poms below it, e.g. 'dk/kb' for the groupIds 'dk.kb.*' at depth 2. The directories above
+    that depth are partitions of their own, holding only their own pom.
+    :param path: The path to find poms in.
+    :param depth: The number of directory levels, i.e. groupId parts, of a partition.
+    :return: Yields (relative path of the partition, True if the partition only holds the pom of the directory itself).
+    """
+    for root, dirs, _ in os.walk(path):
+        relative = os.path.relpath(root, path)
+        level = 0 if relative == '.' else relative.count(os.sep) + 1
+        if level < depth:
+            yield relative, True
+        else:
+            dirs[:] = []
+            yield relative, False
+
+
+def shard_of(partition, shards):
+    """ Returns the shard a partition belongs to, which is the same for every worker and machine. """
+    return zlib.crc32(partition.encode()) % shards
+
+
+def find_shard_poms(shard, shards, path='releases/', depth=group_depth):
+    """
+    Finds the poms of the partitions belonging to the shard.
+    :param shard: The index of the shard, from 0 to shards - 1.
+    :param shards: The number of shards.
+    :param path: The path to find poms in.
+    :param depth: The number of directory levels of a partition.
+    :return: A list of (path of the pom, rank), where the rank is the position of the pom in a run over all poms, as
+    [index of the partition, index of the pom in the partition].
+    """
+    poms = []
+    for index, (partition, own_pom) in enumerate(find_partitions(path, depth)):
+        if shard_of(partition, shards) != shard:
+            continue
+        directory = path if partition == '.' else os.path.join(path, partition)
+        if own_pom:
+            pom_paths = [os.path.join(directory, 'pom.xml')] if os.path.isfile(os.path.join(directory, 'pom.xml')) else []
+        else:
+            pom_paths = find_poms(directory, discovery_threads)
+        poms += [(pom_path, [index, i]) for i, pom_path in enumerate(pom_paths)]
+    return poms
+
+
+def build_shard(shard, shards, path='releases/', output_dir=shard_output_dir, processes=1, depth=group_depth):
+    """
+    Builds the partial structure of a shard. Workers can run on separate machines sharing the file system, and each only holds
+    the poms of its own shard in memory.
+
+    The poms are split into components, see components.record_keys, and the structure of each component is built separately.
+    Three files are written to the output directory:
+    'shard-<i>.keys.json' with the keys of every component, used by the merge to find the components shared with other shards,
+    'shard-<i>.structure.ndjson' with the structure of every component, and 'shard-<i>.records.ndjson' with the records of every
+    component, which the merge only reads for the components shared with other shards.
+    :param shard: The index of the shard, from 0 to shards - 1.
+    :param shards: The number of shards.
+    :param path: The path of the poms.
+    :param output_dir: The directory the files of the shard are written to.
+    :param processes: The number of processes used to parse the poms.
+    :param depth: The number of directory levels, i.e. groupId parts, of a partition.
+    """
+    metrics.reset()
+    with metrics.phase('discovery'):
+        poms = find_shard_poms(shard, shards, path, depth)
+    with metrics.phase('parsing'):
+        records = parse_poms([pom_path for pom_path, _ in poms], processes)
+    ranks = [rank for _, rank in poms]
+    del poms
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    prefix = os.path.join(output_dir, f'shard-{shard}.')
+    keys_of_records = [record_keys(record, ignored_parents) for record in records]
+    all_keys = []
+    with open(prefix + 'structure.ndjson', 'w') as structure_output, open(prefix + 'records.ndjson', 'w') as records_output:
+        for indexes in group_by_keys(keys_of_records):
+            component = [records[i] for i in indexes]
+            struct, poms_left = build_structure(component)
+            package_ranks = rank_packages(((ranks[i], records[i]) for i in indexes), ignored_parents)
+            structure_output.write(json.dumps({
+                'rank': ranks[indexes[0]], 'poms': len(indexes), 'poms_left': poms_left,
+                'package_ranks': package_ranks,
+                'packages': {package: Structure.package_to_dict(val) for package, val in struct.obj.items()},
+                'dependency_map': struct.dependency_map}) + '\n')
+            records_output.write(json.dumps([[ranks[i], records[i]] for i in indexes]) + '\n')
+            all_keys.append(sorted({key for i in indexes for key in keys_of_records[i]}))
+    with open(prefix + 'keys.json', 'w') as output:
+        json.dump(all_keys, output)
+    logging.info(f'Shard {shard} of {shards}: {len(records)} poms in {len(all_keys)} components written to {output_dir}.')
+
+
+def merge_shards(file_type, shards, output_dir=shard_output_dir, impact=False):
+    """
+    Merges the partial structures of every shard and writes the usual output files, as run.py would for all poms.
+
+    Components that are only found in one shard are taken as they are. Components whose poms share a groupId or artifactId with
+    poms of other shards, e.g. when a package has an alternative name in another partition, are assigned again from the records
+    of their poms in every shard. Packages are ordered as in a run over all poms.
+    :param file_type: Defines the output file-type.
+    :param shards: The number of shards.
+    :param output_dir: The directory the files of the shards were written to.
+    :param impact: Also writes the report of the modules affected by a change to each module.
+    """
+    metrics.reset()
+    prefix = os.path.join(output_dir, 'shard-{}.')
+    nodes, keys_of_nodes = [], []
+    for shard in range(shards):
+        with open(prefix.format(shard) + 'keys.json') as keys_input:
+            for component, keys in enumerate(json.load(keys_input)):
+                nodes.append((shard, component))
+                keys_of_nodes.append(keys)
+    shared = {nodes[i]: group for group, indexes in enumerate(group_by_keys(keys_of_nodes)) if len(indexes) > 1
+              for i in indexes}
+    del keys_of_nodes
+    logging.info(f'Merging {len(nodes)} components of {shards} shards, {len(shared)} are shared between shards.')
+
+    # (rank of the first pom, packages, package ranks, dependency map) for every component of the merged structure.
+    parts = []
+    total_nr_of_poms = poms_left = 0
+    shared_records = {}
+    with metrics.phase('merge'):
+        for shard in range(shards):
+            with open(prefix.format(shard) + 'structure.ndjson') as structure_input, \
+                    open(prefix.format(shard) + 'records.ndjson') as records_input:
+                for component, (structure_line, records_line) in enumerate(zip(structure_input, records_input)):
+                    if (shard, component) in shared:
+                        shared_records.setdefault(shared[shard, component], []).extend(
+                            (tuple(rank), intern_record(PomRecord(*values))) for rank, values in json.loads(records_line))
+                        continue
+                    part = json.loads(structure_line)
+                    total_nr_of_poms += part['poms']
+                    poms_left += part['poms_left']
+                    packages = {package: {**val, 'modules': [Module.from_dict(module) for module in val['modules']]}
+                                for package, val in part['packages'].items()}
+                    parts.append((tuple(part['rank']), packages,
+                                  {package: tuple(rank) for package, rank in part['package_ranks'].items()},
+                                  part['dependency_map']))
+
+        for ranked_records in shared_records.values():
+            ranked_records.sort(key=lambda ranked_record: ranked_record[0])
+            records = [record for _, record in ranked_records]
+            struct, component_poms_left = build_structure(records)
+            total_nr_of_poms += len(records)
+            poms_left += component_poms_left
+            parts.append((ranked_records[0][0], struct.obj, rank_packages(ranked_records, ignored_parents),
+                          struct.dependency_map))
+        del shared_records
+
+        merged = merge_components(parts)
+    metrics.count('poms_unassigned', poms_left)
+
+    if poms_left > 0:
+        logging.info(f'Could not assign {str(poms_left)} out of {str(total_nr_of_poms)} poms.')
+    else:
+        logging.info('All poms assigned.')
+
+    write_outputs(merged, file_type, impact)
+
+
+if __name__ == '__main__':
+    setup_logging()
+    parser = argparse.ArgumentParser(
+        description='Builds the dependency structure in shards, partitioned by groupId, which are merged into the usual outputs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Builds the partial structure of one shard.')
+    build_parser.add_argument('shard', type=int, help='The index of the shard, from 0 to SHARDS - 1.')
+    build_parser.add_argument('shards', type=int, help='The number of shards.')
+    build_parser.add_argument('path', nargs='?', default='releases/', help='The path of the poms, by default \'releases/\'.')
+    build_parser.add_argument('--processes', type=int, default=parse_processes,
+                              help='The number of processes used to parse the poms, by default [worker] parse_processes.')
+    build_parser.add_argument('--depth', type=int, default=group_depth,
+                              help='The number of groupId parts of a partition, by default [shard] group_depth. Must be the '
+                                   'same for every shard.')
+    merge_parser = commands.add_parser('merge', help='Merges the partial structures of every shard into the output files.')
+    merge_parser.add_argument('file_type', help='The output file-type, either csv, json, ndjson or sqlite.')
+    merge_parser.add_argument('shards', type=int, help='The number of shards.')
+    merge_parser.add_argument('--impact', action='store_true',
+                              help='Also write affected_modules.json, with the transitive dependencies and dependents of every '
+                                   'module.')
+    for command_parser in (build_parser, merge_parser):
+        command_parser.add_argument('--output-dir', default=shard_output_dir,
+                                    help='The directory of the files of the shards, by default [shard] output_dir.')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_shard(args.shard, args.shards, args.path, args.output_dir, args.processes, args.depth)
+    else:
+        merge_shards(args.file_type, args.shards, args.output_dir, args.impact)
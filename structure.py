@@ -1,15 +1,71 @@
 import csv
 import json
 import logging
+import os
+import sqlite3
+
+from metrics import metrics
+from pom_record import intern
+from structure_hash import hash_package, new_file_digest, structure_tree, write_hashes
+from utility import interpolate
+
+# The <parent> artifactIds that make a pom a parent pom, i.e. the first pom of a package.
+ignored_parents = ['sbforge-parent', 'sbprojects-parent', 'oss-parent']
+
+class Module:
+    """
+    A module in the structure. The strings are interned, so the artifact IDs and versions found in many poms are only stored once,
+    and the dependencies are packed in a single tuple of alternating names and versions, e.g. ('junit', '4.12', 'lxml', '4.9').
+    Modules are only converted to the dictionary shape of the output files when they are written.
+    """
+    __slots__ = ('name', 'version', 'modules', 'dependencies')
+
+    def __init__(self, name, version, dependencies):
+        self.name = intern(name)
+        self.version = intern(version)
+        self.modules = []
+        self.dependencies = pack_dependencies(dependencies)
+
+    def set_dependencies(self, dependencies):
+        """ Replaces the dependencies with the given (name, version) pairs. """
+        self.dependencies = pack_dependencies(dependencies)
+
+    def dependency_items(self):
+        """ Returns the (name, version) pairs of the dependencies. """
+        return zip(self.dependencies[0::2], self.dependencies[1::2])
+
+    def dependency_names(self):
+        """ Returns the names of the dependencies. """
+        return self.dependencies[0::2]
+
+    @classmethod
+    def from_dict(cls, module):
+        """ Creates a module and its child modules from their dictionaries, as written to the .json file. """
+        node = cls(module['name'], module['version'], module['dependencies'].items())
+        node.modules = [cls.from_dict(child) for child in module['modules']]
+        return node
+
+    def to_dict(self):
+        """ Returns the module and its child modules as dictionaries, as they are written to the .json file. """
+        return {'name': self.name, 'version': self.version, 'modules': [module.to_dict() for module in self.modules],
+                'dependencies': dict(self.dependency_items())}
+
+
+def pack_dependencies(dependencies):
+    """ Packs the (name, version) pairs of the dependencies into a tuple of alternating interned names and versions. """
+    return tuple(intern(text) for pair in dependencies for text in pair)
 
 
 class Structure:
-    def __init__(self, number_of_runs, ns):
-        self.ignored_parents = ['sbforge-parent', 'sbprojects-parent', 'oss-parent']
+    def __init__(self):
         self.obj = {}
         self.dependency_map = {}
-        self.number_of_runs = number_of_runs
-        self.ns = ns
+        # (package, artifact ID) -> module, used to find a module without searching through the 'modules' tree.
+        self.module_index = {}
+        # (id of parent module, artifact ID) for every module that has a parent, used to check for duplicate children.
+        self.child_keys = set()
+        # Alternative name (groupId) -> package, the reverse of the 'alt-name' lists in the dictionary.
+        self.alt_names = {}
 
     def create_package(self, package):
         """
@@ -20,6 +76,52 @@ class Structure:
             self.obj[package] = {'modules': [], 'alt-name': []}
             logging.debug(f'Created package: {package}')
 
+    def add_module(self, package, name, version, dependencies, parent=None):
+        """
+        Adds a module to the package, either as a child of the given parent module or at the top level of the package.
+        :param package: The package the module belongs to, which must already be created.
+        :param name: The artifact ID of the module.
+        :param version: The version of the module.
+        :param dependencies: The dependencies of the module, a dictionary of name -> version.
+        :param parent: The parent module, None if the module should be added at the top level of the package.
+        :return: The created module.
+        """
+        module = Module(name, version, dependencies.items())
+        if parent is None:
+            self.obj[package]['modules'].append(module)
+        else:
+            parent.modules.append(module)
+            self.child_keys.add((id(parent), module.name))
+        self.module_index.setdefault((package, module.name), module)
+        return module
+
+    def find_module(self, package, name):
+        """ Returns the first module with the given artifact ID in the package, or None if it does not exist. """
+        metrics.count('module_lookups')
+        return self.module_index.get((package, name))
+
+    def has_child(self, module, name):
+        """ Returns True if the module already has a child module with the given artifact ID. """
+        return (id(module), name) in self.child_keys
+
+    def add_alt_name(self, package, alt_name):
+        """
+        Records an alternative name (groupId) for the package. An alternative name belongs to the first package it is recorded for.
+        :param package: The package the alternative name belongs to.
+        :param alt_name: The alternative name.
+        :return: True if the alternative name was recorded, False if it was already known.
+        """
+        if alt_name in self.alt_names:
+            return False
+        self.alt_names[alt_name] = package
+        self.obj[package]['alt-name'].append(alt_name)
+        return True
+
+    def find_package_by_alt_name(self, alt_name):
+        """ Returns the package that the given alternative name belongs to, or None if it is not a known alternative name. """
+        metrics.count('alt_name_lookups')
+        return self.alt_names.get(alt_name)
+
     def remove_alt_name(self):
         """ Removes the 'alt-name' key from the dictionary."""
         for key, val in self.obj.items():
@@ -27,10 +129,49 @@ class Structure:
             logging.debug(f'Removed \'alt-name\' key from dictionary.')
 
     def write_json(self):
-        """ Writes the dictionary to a .json file. """
+        """
+        Writes the dictionary to a .json file, one package at a time, and the hash of every package and module subtree to
+        structure_hashes.json, used by diff.py to compare two builds. The hashes also give the offset and length of every package
+        in structure.json, so diff.py only has to read the packages that changed, and the digest of structure.json, so diff.py can
+        tell whether the hashes belong to it.
+        """
+        nodes, digest = {}, new_file_digest()
+
+        def write(text):
+            output.write(text)
+            digest.update(text.encode())
+
         with open('structure.json', 'w') as output:
-            json.dump(self.obj, output)
+            write('{')
+            offset = 1
+            for i, (key, val) in enumerate(self.obj.items()):
+                package = self.package_to_dict(val)
+                # json.dumps escapes every non-ASCII character, so the length of the text is its length in bytes.
+                prefix, text = (', ' if i else '') + json.dumps(key) + ': ', json.dumps(package)
+                write(prefix + text)
+                offset += len(prefix)
+                nodes[key] = {**hash_package(key, package['modules']), 'at': [offset, len(text)]}
+                offset += len(text)
+            write('}')
+        metrics.count_file('structure.json')
         logging.info('Structure written to .json file.')
+        write_hashes({**structure_tree(nodes), 'digest': digest.hexdigest()})
+
+    @staticmethod
+    def package_to_dict(package):
+        """ Returns the package with its modules as dictionaries, as it is written to the .json file. """
+        return {key: [module.to_dict() for module in val] if key == 'modules' else val for key, val in package.items()}
+
+    def write_ndjson(self):
+        """ Writes the dictionary to a .ndjson file, with one module per line. """
+        with open('structure.ndjson', 'w') as output:
+            for key, val in sorted(self.obj.items()):
+                for module, parent in self.__iterate_modules(val['modules']):
+                    output.write(json.dumps({'package': key, 'module': module.name, 'version': module.version,
+                                             'parent': parent.name if parent is not None else None,
+                                             'dependencies': dict(module.dependency_items())}) + '\n')
+        metrics.count_file('structure.ndjson')
+        logging.info('Structure written to .ndjson file.')
 
     def write_csv(self):
         """ Writes the dictionary to a .csv file. """
@@ -38,43 +179,143 @@ class Structure:
         with open('structure.csv', 'w', encoding="utf-8-sig") as output:
             writer = csv.DictWriter(output, fieldnames=fields)
             writer.writeheader()
-            self.__write_rows(writer)
+            writer.writerows(self.iterate_rows())
+        metrics.count_file('structure.csv')
         logging.info('Structure written to .csv file.')
 
-    def __write_rows(self, writer):
-        """ Sorts and writes the row to the .csv file using the csv-writer. """
+    def iterate_rows(self):
+        """
+        Generator yielding the rows of the .csv file one by one, sorted by package and then by module.
+
+        The modules of a package are grouped by the module column of the rows they create, so the rows can be created in sorted
+        order without first creating and sorting every row of the package.
+        """
         for key, val in sorted(self.obj.items()):
-            rows = self.__recursively_create_rows(key, val['modules'])
-            writer.writerows(sorted(rows, key=lambda i: i['module']))
-
-    def __recursively_create_rows(self, package, obj, parent=None, parent_version=None):
-        """ Recursively calls __get_row_to_append for each module in the dictionary, to reach all modules and create a row for each of
-        them and their dependencies. """
-        row = []
-        for module in obj:
-            row.extend(self.__get_row_to_append(module, package, parent, parent_version))
-            row.extend(self.__recursively_create_rows(package, module['modules'], module['name'], module['version']))
-        return row
+            # Module column -> (module, child) for each module creating rows in that column, in the order the rows are created.
+            # The child is None for the rows of the module's own dependencies.
+            row_groups = {}
+            for module, parent in self.__iterate_modules(val['modules']):
+                if parent is not None and parent.version:
+                    row_groups.setdefault(parent.name, []).append((parent, module))
+                row_groups.setdefault(module.name, []).append((module, None))
+            for name in sorted(row_groups):
+                for module, child in row_groups[name]:
+                    yield from self.__get_rows(key, module, child)
+
+    @staticmethod
+    def __iterate_modules(modules):
+        """ Generator yielding (module, parent module) for every module in the 'modules' tree, depth-first. The parent module is
+        None for the modules at the top level. """
+        stack = [(module, None) for module in reversed(modules)]
+        while stack:
+            module, parent = stack.pop()
+            yield module, parent
+            stack.extend((child, module) for child in reversed(module.modules))
 
     @staticmethod
-    def __get_row_to_append(module, package, parent, parent_version):
-        """ Creates a list of rows to be written for each dependency that a module has.
-            Also ensures to add a row for each child that a parent has. """
-        rows = []
-        if parent and parent_version:
-            rows.append({'package': package, 'module': parent, 'version': parent_version, 'dependency': module['name'],
-                         'dependency_version': module['version']})
-        for key, val in module['dependencies'].items():
-            rows.append({'package': package, 'module': module['name'], 'version': module['version'], 'dependency': key,
-                         'dependency_version': val})
+    def __get_rows(package, module, child):
+        """ Generator yielding the row for the child of the module if a child is given, and otherwise a row for each
+            dependency that the module has. """
+        if child is not None:
+            yield {'package': package, 'module': module.name, 'version': module.version, 'dependency': child.name,
+                   'dependency_version': child.version}
+            return
+        for key, val in module.dependency_items():
+            yield {'package': package, 'module': module.name, 'version': module.version, 'dependency': key,
+                   'dependency_version': val}
         # FIXME: If it is necessary to see a module if it has no dependencies then this part can be introduced again.
-        # if not module['dependencies']:
-        #    rows.append({'package': package, 'module': module['name'], 'version': module['version'], 'dependency': "",
-        #    'dependency_version': ""})
-        return rows
+        # if not module.dependencies:
+        #    yield {'package': package, 'module': module.name, 'version': module.version, 'dependency': "",
+        #    'dependency_version': ""}
+
+    def write_sqlite(self, path='structure.sqlite', batch_size=10000):
+        """
+        Writes the dictionary to a SQLite file, with a table for each of the packages, the modules with a link to their parent
+        module, the dependencies of the modules and the properties of the modules, resolved using the properties they inherit.
+        The rows are inserted in batches in a single transaction, and the indexes are created afterwards. The file is written
+        under a temporary name and then replaces the old file, so it can be queried while it is written.
+        :param path: The path of the SQLite file.
+        :param batch_size: The number of rows inserted at a time.
+        """
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+        connection = sqlite3.connect(path + '.tmp')
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript('''
+            CREATE TABLE packages (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE modules (id INTEGER PRIMARY KEY, package_id INTEGER NOT NULL REFERENCES packages (id),
+                                  parent_id INTEGER REFERENCES modules (id), name TEXT NOT NULL, version TEXT);
+            CREATE TABLE dependencies (module_id INTEGER NOT NULL REFERENCES modules (id), artifact TEXT NOT NULL, version TEXT);
+            CREATE TABLE properties (module_id INTEGER NOT NULL REFERENCES modules (id), name TEXT NOT NULL, value TEXT);
+        ''')
+        statements = {'packages': 'INSERT INTO packages VALUES (?, ?)', 'modules': 'INSERT INTO modules VALUES (?, ?, ?, ?, ?)',
+                      'dependencies': 'INSERT INTO dependencies VALUES (?, ?, ?)',
+                      'properties': 'INSERT INTO properties VALUES (?, ?, ?)'}
+        batches = {table: [] for table in statements}
+
+        def insert(table, row):
+            batches[table].append(row)
+            if len(batches[table]) >= batch_size:
+                connection.executemany(statements[table], batches[table])
+                batches[table].clear()
+
+        with connection:
+            module_ids = {}
+            for package_id, (key, val) in enumerate(sorted(self.obj.items()), 1):
+                insert('packages', (package_id, key))
+                package_map = self.dependency_map.get(key, {})
+                # (module, parent module, properties of the parent module)
+                stack = [(module, None, {}) for module in reversed(val['modules'])]
+                while stack:
+                    module, parent, inherited_properties = stack.pop()
+                    module_id = module_ids[id(module)] = len(module_ids) + 1
+                    insert('modules', (module_id, package_id, module_ids[id(parent)] if parent is not None else None,
+                                       module.name, module.version))
+                    for dependency, dependency_version in module.dependency_items():
+                        insert('dependencies', (module_id, dependency, dependency_version))
+                    own_properties = package_map.get(module.name, {})
+                    properties, resolved = {**inherited_properties, **own_properties}, {}
+                    for name, value in own_properties.items():
+                        insert('properties', (module_id, name[2:-1], interpolate(value, properties, resolved)))
+                    stack.extend((child, module, properties) for child in reversed(module.modules))
+            for table, rows in batches.items():
+                connection.executemany(statements[table], rows)
+            connection.executescript('''
+                CREATE INDEX modules_name ON modules (name);
+                CREATE INDEX modules_parent ON modules (parent_id);
+                CREATE INDEX dependencies_module ON dependencies (module_id);
+                CREATE INDEX dependencies_artifact ON dependencies (artifact, version);
+                CREATE INDEX properties_module ON properties (module_id);
+            ''')
+        connection.close()
+        os.replace(path + '.tmp', path)
+        metrics.count_file(path)
+        logging.info('Structure written to .sqlite file.')
+
+    def write_dependency_index_json(self):
+        """
+        Writes the inverted dependency index to a .json file. 'dependents' maps every dependency artifact to the modules using it,
+        and 'modules' maps every module name to where it is found in the dictionary.
+        """
+        dependents, modules = {}, {}
+        for key, val in sorted(self.obj.items()):
+            for module, parent in self.__iterate_modules(val['modules']):
+                modules.setdefault(module.name, []).append(
+                    {'package': key, 'version': module.version, 'parent': parent.name if parent is not None else None,
+                     'dependencies': dict(module.dependency_items())})
+                for dependency, dependency_version in module.dependency_items():
+                    dependents.setdefault(dependency, []).append(
+                        {'package': key, 'module': module.name, 'version': module.version,
+                         'dependency_version': dependency_version})
+        with open('dependency_index.json', 'w') as output:
+            json.dump({'dependents': dependents, 'modules': modules}, output)
+        metrics.count_file('dependency_index.json')
+        logging.info('Dependency index written to .json file.')
 
     def write_dependency_map_json(self):
         """ Writes the dependency map to a .json file. """
         with open('dependency_map.json', 'w') as output:
             json.dump(self.dependency_map, output)
+        metrics.count_file('dependency_map.json')
         logging.info('Dependency map written to .json file.')
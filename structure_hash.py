@@ -0,0 +1,84 @@
+import hashlib
+import json
+import logging
+
+from metrics import metrics
+
+
+def hash_package(package, modules):
+    """
+    Returns the node of a package in the Merkle tree of the structure. The hash of a module covers its name, version and
+    dependencies, and the hashes of its child modules, so two builds only differ below a module if its hashes differ. The order of
+    modules and dependencies does not change the hashes.
+    :param package: The name of the package.
+    :param modules: The modules of the package as dictionaries, as written to structure.json.
+    :return: A dictionary with the 'hash' of the package and its 'modules', the tree of module key -> {'hash' of the subtree,
+    'own' hash of the module, 'modules'}, see module_keys.
+    """
+    modules = __hash_modules(modules)
+    return {'hash': __digest([package, sorted(node['hash'] for node in modules.values())]), 'modules': modules}
+
+
+def hash_structure(packages):
+    """
+    Returns the Merkle tree of the structure, with a hash of every package and of every module subtree, see hash_package. The order
+    of the packages does not change the hashes.
+    :param packages: The (package, modules) pairs of the structure, with the modules as dictionaries.
+    :return: A dictionary with the 'hash' of the structure and its 'packages', package -> node of the package.
+    """
+    return structure_tree({package: hash_package(package, modules) for package, modules in packages})
+
+
+def structure_tree(nodes):
+    """ Returns the Merkle tree of the structure from the package -> node of every package. """
+    return {'hash': __digest(sorted(node['hash'] for node in nodes.values())), 'packages': dict(sorted(nodes.items()))}
+
+
+def __hash_modules(modules):
+    """ Returns the module key -> node of the Merkle tree of every module, and recursively of their child modules. """
+    nodes = {}
+    for key, module in module_keys(modules).items():
+        children = __hash_modules(module['modules'])
+        own = __digest([module['name'], module['version'], sorted(module['dependencies'].items())])
+        nodes[key] = {'hash': __digest([own, sorted(node['hash'] for node in children.values())]), 'own': own,
+                      'modules': children}
+    return nodes
+
+
+def __digest(value):
+    """ Returns the hash of a json serializable value. """
+    return hashlib.blake2b(json.dumps(value).encode(), digest_size=16).hexdigest()
+
+
+def module_keys(modules):
+    """
+    Returns the modules by their key, which is the name of the module. A module with the same name as an earlier module on the same
+    level gets the key 'name#n', for the n'th module with the name.
+    """
+    keyed, seen = {}, {}
+    for module in modules:
+        seen[module['name']] = seen.get(module['name'], 0) + 1
+        keyed[module['name'] if seen[module['name']] == 1 else f'{module["name"]}#{seen[module["name"]]}'] = module
+    return keyed
+
+
+def new_file_digest():
+    """ Returns the hash object used for the digest of structure.json, recorded in structure_hashes.json. """
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_digest(path):
+    """ Returns the digest of the content of a file, as recorded for structure.json in structure_hashes.json. """
+    digest = new_file_digest()
+    with open(path, 'rb') as digested:
+        for chunk in iter(lambda: digested.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_hashes(hashes, path='structure_hashes.json'):
+    """ Writes the Merkle tree of the structure to a .json file. """
+    with open(path, 'w') as output:
+        json.dump(hashes, output)
+    metrics.count_file(path)
+    logging.info('Structure hashes written to .json file.')
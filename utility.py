@@ -1,53 +1,49 @@
 import logging
+import re
+
+from metrics import metrics
+from pom_record import intern
 
 strings_to_replace = ['${parent.artifactid}', '${parent.artifactId}', '${project.parent.artifactId}', '${project.parent.artifactid}']
+placeholder_pattern = re.compile(r'\$\{[^}]*}')
+
+# Maven version qualifiers in the order they are sorted, the empty qualifier being a release. Unknown qualifiers sort after these.
+version_qualifiers = ['alpha', 'beta', 'milestone', 'rc', 'snapshot', '', 'sp']
+version_qualifier_aliases = {'a': 'alpha', 'b': 'beta', 'm': 'milestone', 'cr': 'rc', 'ga': '', 'final': '', 'release': ''}
 
 
-def get_pom_vars(tree, struct):
+def get_pom_vars(record):
     """
-    Given the tree object, read the tags and extract the information.
-    :param tree: A lxml etree.parse(path) object.
-    :param struct: The structure object.
+    Given the pom record, extract the information used to assign the pom as a child.
+    :param record: The PomRecord of the pom.
     :return: Alternative package ID, child ID, dependencies, package ID, parent ID, version
     """
-    ns = struct.ns
     # Find child artifactID
-    child_id = tree.xpath('./pom:artifactId', namespaces=ns)[0].text.lower()
+    child_id = record.artifact_id
     # Use parents version if it does not have its own version defined.
-    version = tree.xpath('//pom:parent/pom:version', namespaces=ns)[0].text if len(tree.xpath('./pom:version', namespaces=ns)) == 0 else \
-        tree.xpath('./pom:version', namespaces=ns)[0].text
+    version = record.parent_version if record.version is None else record.version
     # GroupId of parent is used to find package in structure dictionary
-    package_id = tree.xpath('//pom:parent/pom:groupId', namespaces=ns)[0].text.lower() if len(tree.xpath('//pom:parent/pom:groupId',
-                                                                                                         namespaces=ns)) != 0 else None
+    package_id = record.parent_group_id
     # Extra groupId will be used as alternative name
-    alt_package_id = tree.xpath('./pom:groupId', namespaces=ns)[0].text.lower() if len(tree.xpath('./pom:groupId',
-                                                                                                  namespaces=ns)) > 0 else None
+    alt_package_id = record.group_id
     # Parent artifactID, None if there's no parent ID
-    parent_id = tree.xpath('//pom:parent/pom:artifactId', namespaces=ns)[0].text.lower() if len(
-        tree.xpath('//pom:parent/pom:artifactId',
-                   namespaces=ns)) != 0 else None
-    # Maps the versions that are declared through properties in the parent pom to their actual values
-    map_dependency_version(alt_package_id if package_id is None else package_id, child_id, version, tree, struct)
-    dependencies = find_dependencies(tree, parent_id, ns)
+    parent_id = record.parent_artifact_id
+    dependencies = find_dependencies(record.dependencies, parent_id)
 
     return alt_package_id, child_id, dependencies, package_id, parent_id, version
 
 
-def map_dependency_version(package_id, module_id, version, tree, struct):
+def map_dependency_version(package_id, module_id, version, properties, struct):
     """
     Maps dependencies that are defined using a name defined in <properties> tag, e.g. ${project.version}.
     :param package_id: Package ID, e.g. 'org.biterepository' or 'dk.kb.netarchivesuite'.
     :param module_id: The artifact ID found in the <parent> tag in the pom.
     :param version: The version of the dependency.
-    :param tree: The lxml etree.parse(path) tree object.
+    :param properties: The (tag, text) pairs found under the <properties> tag in the pom.
     :param struct: The structure object.
     """
-    ns, obj, dependency_map = struct.ns, struct.obj, struct.dependency_map
-    properties = tree.xpath('./pom:properties', namespaces=ns)
-    for key, val in obj.items():
-        if package_id in val['alt-name']:
-            package_id = key
-            break
+    dependency_map = struct.dependency_map
+    package_id = struct.find_package_by_alt_name(package_id) or package_id
 
     old_maps = dependency_map[package_id] if package_id in dependency_map else {}
 
@@ -56,86 +52,90 @@ def map_dependency_version(package_id, module_id, version, tree, struct):
     # Adds a dependency map for 'project.version' -> version found in pom.
     maps[module_id]['${project.version}'] = version
 
-    for p in properties:
-        for i in range(len(p)):
-            property_text = p[i].text
-            tag = str(p[i].tag).split('}', 1)[-1]
-            maps[module_id]['${' + tag + '}'] = property_text
+    for tag, property_text in properties:
+        maps[module_id]['${' + tag + '}'] = property_text
     maps.update(old_maps)
     dependency_map[package_id] = maps
 
 
-def find_dependencies(tree, parent_id, ns):
+def find_dependencies(pom_dependencies, parent_id):
     """
     Find the dependencies of the pom
-    :param tree: The lxml etree.parse(path) tree object.
+    :param pom_dependencies: The (artifactId, version) pairs of the dependencies in the pom record.
     :param parent_id: The parent ID (Artifact ID) of the <parent> tag in the pom.
-    :param ns: The namespace, found in the structure, as defined in the config file.
-    :return: A list of dependencies.
+    :return: A dictionary of dependencies.
     """
     dependencies = {}
-    pom_dependencies = tree.xpath('//pom:dependencies/pom:dependency', namespaces=ns)
-
-    for dependency in pom_dependencies:
-        dependency_name = dependency.xpath('./pom:artifactId', namespaces=ns)[0].text
+    for dependency_name, version in pom_dependencies:
         dependency_name = __fix_name(dependency_name, parent_id)
-        dependency_version = dependency.xpath('./pom:version', namespaces=ns)
-        version = dependency_version[0].text if dependency_version else 'inherited'
         dependencies[dependency_name] = version
     return dependencies
 
 
 def fix_dependency_versions(obj, dependency_map):
     """
-    Checks if the version of the given dependency is correct.
-    :return: Returns either a more readable version found in the dependency_map, or the original version.
+    Replaces the ${...} placeholders in the versions of the dependencies with the values of the module's properties.
+
+    The properties of a module are the ones mapped for it in the dependency map, together with the ones of its parent modules,
+    where the closest definition wins. Each module gets one property table, in which every property is resolved at most once.
+    :param obj: The structure dictionary.
+    :param dependency_map: The dependency map, package -> module -> property -> value.
     """
     for key, val in obj.items():
-        package_id = key
-        for parent in obj[key]['modules']:
-            parent_id = parent['name']
-            __insert_new_version(parent, package_id, parent_id, dependency_map)
-            __recursive_fix_dependencies(package_id, parent_id, parent['modules'], parent_id, dependency_map)
+        package_map = dependency_map.get(key, {})
+        # (module, artifact ID of the closest parent, properties of the parent)
+        stack = [(module, None, {}) for module in reversed(val['modules'])]
+        while stack:
+            module, closest_parent_id, inherited_properties = stack.pop()
+            properties = {**inherited_properties, **package_map.get(module.name, {})}
+            __insert_new_version(module, properties)
+            module.name = intern(__fix_name(module.name, closest_parent_id))
+            stack.extend((child, module.name, properties) for child in reversed(module.modules))
 
 
-def __recursive_fix_dependencies(package_id, absolute_parent_id, current, closest_parent_id, dependency_map):
+def __insert_new_version(module, properties):
     """
-    Recursively runs through the dependencies of every module to try to fix their version ID by mapping them to the dependency map.
-    :param package_id: The package ID under which the modules are present in both the dependency map and the overall structure.
-    :param absolute_parent_id: The ID of the parent to every single module.
-    :param current: The current placement in the dictionary tree.
+    Performs the actual insertion of the resolved versions into the structure dictionary object.
     """
-    for module in current:
-        __insert_new_version(module, package_id, absolute_parent_id, dependency_map)
-        module['name'] = __fix_name(module['name'], closest_parent_id)
-        __recursive_fix_dependencies(package_id, absolute_parent_id, module['modules'], module['name'], dependency_map)
+    resolved, dependencies = {}, []
+    for name, version in module.dependency_items():
+        new_version = interpolate(version, properties, resolved)
+        dependencies.append((name, new_version))
+        logging.debug(f'Updated version: {name}:{version} -> {new_version}')
+    module.set_dependencies(dependencies)
 
 
-def __insert_new_version(module, package_id, parent_id, dependency_map):
+def interpolate(value, properties, resolved, resolving=()):
     """
-    Performs the actual insertion of the name into the structure dictionary object.
+    Replaces every ${...} placeholder in the value with the resolved value of the property, e.g. '${a}.${b}-x' -> '1.2-x'.
+    Placeholders of unknown properties, and of properties that refer back to themselves, are left as they are.
+    :param value: The value to interpolate.
+    :param properties: The property table, '${name}' -> value.
+    :param resolved: The properties of the table that are already resolved, '${name}' -> resolved value. Is updated.
+    :param resolving: The properties that are currently being resolved, used to detect cycles.
+    :return: The interpolated value.
     """
-    for dependency in module['dependencies']:
-        name, version = dependency, module['dependencies'][dependency]
-        new_version = __get_new_version(module, package_id, parent_id, version, dependency_map)
-        module['dependencies'][name] = new_version
-        logging.debug(f'Updated version: {name}:{version} -> {new_version}')
+    if not value or '${' not in value:
+        return value
+    return placeholder_pattern.sub(lambda match: __resolve_property(match.group(0), properties, resolved, resolving), value)
 
 
-def __get_new_version(module, package_id, parent_id, version, dependency_map):
+def __resolve_property(key, properties, resolved, resolving):
     """
-    If the version contains the chars '${', then we try to map it to a correct version, running recursively
-    :return: New version
+    Returns the resolved value of the property, resolving and caching it if it has not been resolved before.
     """
-    if version and '${' in version:
-        new_version = dependency_map[package_id][module['name']][version] \
-            if version in dependency_map[package_id][module['name']] else dependency_map[package_id][parent_id][version] \
-            if version in dependency_map[package_id][parent_id] else version
-
-        if '${' in new_version:
-            new_version = __get_new_version(module, package_id, parent_id, new_version, dependency_map)
-        return new_version
-    return version
+    if key in resolved:
+        return resolved[key]
+    if key not in properties:
+        metrics.count('unresolved_placeholders')
+        return key
+    if key in resolving:
+        logging.warning(f'Cycle in properties: {" -> ".join(resolving[resolving.index(key):] + (key,))}')
+        return key
+    value = interpolate(properties[key], properties, resolved, resolving + (key,))
+    metrics.count('properties_resolved')
+    resolved[key] = value
+    return value
 
 
 def __fix_name(name, parent_id):
@@ -151,3 +151,27 @@ def __fix_name(name, parent_id):
             logging.debug(f'Name changed: {name} -> {new_name}')
             return new_name
     return name
+
+
+def version_key(version):
+    """
+    Returns a key that sorts Maven versions in version order instead of alphabetically, e.g. 1.9 < 1.10 and 1.0-rc1 < 1.0 < 1.0.1.
+    Numbers are compared as numbers, and qualifiers as ordered in version_qualifiers.
+    :param version: The version, e.g. '1.10' or '2.0.0-beta-2'.
+    :return: A tuple that can be used as sort key.
+    """
+    key = []
+    for part in re.findall(r'\d+|[a-z]+', version.lower()) + ['']:
+        if part.isdigit():
+            key.append((2, int(part), ''))
+            continue
+        # Zeros before a qualifier or the end do not change the version, so 1.0 == 1.0.0 and 1.0-rc1 == 1-rc1.
+        while key and key[-1] == (2, 0, ''):
+            key.pop()
+        qualifier = version_qualifier_aliases.get(part, part)
+        if qualifier in version_qualifiers:
+            key.append((1, version_qualifiers.index(qualifier), ''))
+        else:
+            key.append((1, len(version_qualifiers), qualifier))
+    # Every version ends as a release, which makes 1.0 sort after 1.0-rc1, but before 1.0.1.
+    return tuple(key)
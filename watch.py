@@ -0,0 +1,328 @@
+import argparse
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+from lxml import etree
+
+from components import group_by_keys, merge_components, rank_packages, record_keys
+from pom_cache import PomCache
+from pom_record import read_pom_record
+from run import build_structure, config, discovery_threads, find_poms, ns, parse_processes, pom_cache_path, read_poms, \
+    setup_logging, walk_poms_counted, write_outputs
+from structure import ignored_parents
+
+poll_interval = config.getfloat("watch", "poll_interval")
+debounce = config.getfloat("watch", "debounce")
+
+# Constants from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+# struct inotify_event: wd, mask, cookie and the length of the name that follows.
+event_header = struct.Struct('iIII')
+
+
+class Component:
+    """
+    A group of poms that can be assigned independently of all other poms, with its own structure. Two poms are in the same
+    component if they share a groupId or artifactId used to assign them, see components.record_keys.
+    """
+
+    def __init__(self, paths, keys, struct, package_ranks):
+        # The paths of the poms, in the order they were found.
+        self.paths = paths
+        self.keys = keys
+        self.struct = struct
+        # Package -> rank of the first pom creating it, which is the order of the packages in a run over all poms.
+        self.package_ranks = package_ranks
+
+
+class PomWatcher:
+    """
+    Keeps the records of the poms and the structure built from them in memory, and patches it when poms are added, changed or
+    removed.
+
+    The poms are split into components, which are built separately. When poms change, only they are parsed again, and only the
+    components they were or are now part of are built again, from the records kept in memory. The structure written to the
+    output files is merged from the structures of the components, in the same order as a run over all poms.
+    """
+
+    def __init__(self, path, processes=1, cache_path=None):
+        self.path = path
+        self.records, self.stats, self.ranks = {}, {}, {}
+        self.components, self.component_of_key = {}, {}
+        self.next_component = 0
+        if cache_path:
+            cache = PomCache(cache_path)
+            records = read_poms(path, processes, cache, threads=discovery_threads)
+            cache.close()
+        else:
+            records = read_poms(path, processes, threads=discovery_threads)
+        for rank, record in enumerate(records):
+            self.records[record.path] = record
+            self.stats[record.path] = self.__stat(record.path)
+            self.ranks[record.path] = rank
+        self.next_rank = len(records)
+        self.__build_components(list(self.records))
+        logging.info(f'Watching {len(self.records)} poms in {len(self.components)} components.')
+
+    def update(self, paths):
+        """
+        Patches the structure with the changes to the given poms.
+        :param paths: The paths of the poms that may have changed, or of directories in which any pom may have changed.
+        :return: True if any pom was added, changed or removed.
+        """
+        start = time.perf_counter()
+        changed = self.__find_changes(paths)
+        if not changed:
+            return False
+
+        # Every component sharing a key with the old or new version of a changed pom is built again.
+        keys = [key for path in changed if path in self.records for key in self.__record_keys(self.records.pop(path))]
+        for path, stat in changed.items():
+            self.stats[path] = stat
+            if stat is None:
+                self.stats.pop(path)
+                self.ranks.pop(path, None)
+                continue
+            try:
+                self.records[path] = read_pom_record(path, ns)
+            except (etree.XMLSyntaxError, AttributeError, KeyError, OSError) as error:
+                logging.warning(f'Could not read {path}, it is left out until it changes again: {error}')
+                continue
+            keys += self.__record_keys(self.records[path])
+            if path not in self.ranks:
+                self.ranks[path] = self.next_rank
+                self.next_rank += 1
+
+        affected = {self.component_of_key[key] for key in keys if key in self.component_of_key}
+        paths_to_build = {path for path in changed if path in self.records}
+        for component_id in affected:
+            component = self.components.pop(component_id)
+            paths_to_build.update(path for path in component.paths if path in self.records)
+            for key in component.keys:
+                del self.component_of_key[key]
+
+        self.__build_components(paths_to_build)
+        logging.info(f'Patched {len(changed)} changed poms, {len(paths_to_build)} poms in {len(affected)} components were '
+                     f'assigned again in {(time.perf_counter() - start) * 1000:.1f} ms.')
+        return True
+
+    def merged_structure(self):
+        """
+        Returns a structure with the packages of every component, in the order a run over all poms creates them. The modules
+        are shared with the components, but the packages are copied, so the structure can be written by write_outputs.
+        """
+        return merge_components([(self.ranks[component.paths[0]], component.struct.obj, component.package_ranks,
+                                  component.struct.dependency_map) for component in self.components.values()])
+
+    def __record_keys(self, record):
+        """ Returns the keys the pom is assigned by. """
+        return record_keys(record, ignored_parents)
+
+    def __build_components(self, paths):
+        """ Splits the poms into components, and builds the structure of each component. """
+        paths = sorted(paths, key=self.ranks.get)
+        for indexes in group_by_keys([self.__record_keys(self.records[path]) for path in paths]):
+            component_paths = [paths[i] for i in indexes]
+            records = [self.records[path] for path in component_paths]
+            struct, _ = build_structure(records)
+            package_ranks = rank_packages(((self.ranks[record.path], record) for record in records), ignored_parents)
+            keys = {key for record in records for key in self.__record_keys(record)}
+            component_id = self.next_component
+            self.next_component += 1
+            self.components[component_id] = Component(component_paths, keys, struct, package_ranks)
+            for key in keys:
+                self.component_of_key[key] = component_id
+
+    def __find_changes(self, paths):
+        """
+        Finds the poms that were added, changed or removed, by comparing the mtime and size of the poms with the ones they had
+        when they were read.
+        :param paths: The paths of poms, or of directories in which to look for changed poms.
+        :return: A dictionary of path -> new stat, where the stat is None if the pom was removed.
+        """
+        # Used as an ordered set, so new poms are ranked in the order they are found.
+        candidates = {}
+        for path in paths:
+            if os.path.basename(path) == 'pom.xml':
+                candidates[path] = None
+            else:
+                prefix = os.path.join(path, '')
+                candidates.update((known, None) for known in self.stats if known.startswith(prefix))
+                candidates.update((found, None) for found in find_poms(path))
+        changed = {}
+        for path in candidates:
+            stat = self.__stat(path)
+            if stat != self.stats.get(path):
+                changed[path] = stat
+        return changed
+
+    @staticmethod
+    def __stat(path):
+        """ Returns the mtime and size of the file, or None if it does not exist. """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+class PollingSource:
+    """ Finds changed poms by walking the directory at a fixed interval, comparing the mtime and size of every pom. """
+
+    def __init__(self, path, stats, interval=poll_interval):
+        self.path = path
+        self.stats = dict(stats)
+        self.interval = interval
+
+    def changes(self, timeout):
+        """ Waits for the interval, and returns the paths of the poms that were added, changed or removed since last time. """
+        time.sleep(max(timeout, self.interval))
+        stats = {path: (mtime_ns, size) for path, size, mtime_ns in walk_poms_counted(self.path, discovery_threads)[0]}
+        changed = {path for path in stats.keys() | self.stats.keys() if stats.get(path) != self.stats.get(path)}
+        self.stats = stats
+        return changed
+
+
+class InotifySource:
+    """
+    Finds changed poms using inotify on Linux, with a watch on every directory. Raises OSError if inotify is not available or the
+    directories can not all be watched, e.g. because of the fs.inotify.max_user_watches limit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available.')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+        self.directories = {}
+        try:
+            self.__watch_tree(path)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def changes(self, timeout):
+        """
+        Waits up to the timeout for events, and returns the paths of the poms that changed, together with the directories that
+        were created, moved or removed, in which any pom may have changed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = event_header.unpack_from(data, offset)
+                name = data[offset + event_header.size:offset + event_header.size + length].rstrip(b'\0').decode()
+                offset += event_header.size + length
+                if mask & IN_Q_OVERFLOW:
+                    logging.warning('Inotify queue overflowed, looking through every pom.')
+                    changed.add(self.path)
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.directories[wd]
+                    continue
+                if mask & IN_DELETE_SELF:
+                    changed.add(directory)
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.__watch_tree(path)
+                    changed.add(path)
+                elif name == 'pom.xml' and mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                    changed.add(path)
+
+    def __watch_tree(self, path):
+        """ Adds a watch on the directory and every directory below it. """
+        for directory, _, _ in os.walk(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f'Could not watch {directory}: {os.strerror(errno)}')
+            self.directories[wd] = directory
+
+
+def watch(file_type, path='releases/', processes=1, cache_path=None, impact=False, polling=False):
+    """
+    Builds the structure once and writes the output files, then keeps watching the poms. When poms are added, changed or
+    removed, the structure is patched and the output files are written again, once no more changes have been seen for the
+    debounce time.
+    :param file_type: Defines the output file-type.
+    :param path: Defines the path of the poms, by default uses the value 'releases/'.
+    :param processes: The number of processes used to parse the poms when the structure is first built.
+    :param cache_path: The path of the pom cache used when the structure is first built.
+    :param impact: Also writes the report of the modules affected by a change to each module.
+    :param polling: Finds changes by walking the directory, instead of using inotify.
+    """
+    watcher = PomWatcher(path, processes, cache_path)
+    write_outputs(watcher.merged_structure(), file_type, impact)
+    source = None
+    if not polling:
+        try:
+            source = InotifySource(path)
+        except (OSError, AttributeError) as error:
+            logging.warning(f'Could not use inotify, polling every {poll_interval} seconds instead: {error}')
+    if source is None:
+        source = PollingSource(path, watcher.stats)
+
+    pending, last_change = set(), 0
+    while True:
+        paths = source.changes(debounce if pending else poll_interval)
+        if paths:
+            pending |= paths
+            last_change = time.monotonic()
+        elif pending and time.monotonic() - last_change >= debounce:
+            if watcher.update(pending):
+                write_outputs(watcher.merged_structure(), file_type, impact)
+            pending = set()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Creates the dependency structure of the downloaded poms, and keeps it up to '
+                                                 'date while the poms change.')
+    parser.add_argument('file_type', help='The output file-type, either csv, json, ndjson or sqlite.')
+    parser.add_argument('path', nargs='?', default='releases/', help='The path of the poms, by default \'releases/\'.')
+    parser.add_argument('--processes', type=int, default=parse_processes,
+                        help='The number of processes used to parse the poms at start, by default [worker] parse_processes.')
+    parser.add_argument('--cache', default=pom_cache_path,
+                        help='The cache of parsed poms used at start, by default [worker] pom_cache. Use an empty string to '
+                             'parse all poms.')
+    parser.add_argument('--impact', action='store_true',
+                        help='Also write affected_modules.json, with the transitive dependencies and dependents of every module.')
+    parser.add_argument('--polling', action='store_true',
+                        help='Walk the directory every [watch] poll_interval seconds instead of using inotify.')
+    args = parser.parse_args()
+    try:
+        watch(args.file_type, args.path, args.processes, args.cache, args.impact, args.polling)
+    except KeyboardInterrupt:
+        logging.info('Stopped watching.')